@@ -0,0 +1,294 @@
+import io
+import math
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+# File types picked up when audio is gathered from a directory.
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg")
+
+
+def run_ffmpeg(source, sr=SAMPLE_RATE, data=None):
+    """Run ffmpeg on a path or pipe and return mono 16-bit PCM at the given sample rate."""
+    cmd = [
+        "ffmpeg",
+        "-threads", "0",
+        "-i", source,
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sr),
+        "-loglevel", "error",
+        "pipe:1",
+    ]
+    if data is None:
+        cmd.insert(1, "-nostdin")
+    result = subprocess.run(cmd, input=data, capture_output=True, check=True)
+    return result.stdout
+
+
+def resample(audio, orig_sr, sr=SAMPLE_RATE, block_seconds=1.0, pad_seconds=0.1):
+    """Resample audio by truncating or zero-padding the spectrum of short overlapping blocks.
+
+    Each block spans a whole number of periods of the rate ratio, so it maps
+    to an exact number of output samples, and the padding on both sides takes
+    the ringing where the FFT wraps around. Cost grows linearly with length and
+    no FFT has an awkward size, however long or oddly sized the clip.
+    """
+    if orig_sr == sr or not len(audio):
+        return audio
+    divisor = math.gcd(orig_sr, sr)
+    up, down = sr // divisor, orig_sr // divisor
+    block = max(1, round(block_seconds * orig_sr / down)) * down
+    pad = max(1, round(pad_seconds * orig_sr / down)) * down
+    out_block = block * up // down
+    out_pad = pad * up // down
+    size = out_block + 2 * out_pad
+
+    count = -(-len(audio) // block)
+    padded = np.zeros(count * block + 2 * pad, np.float32)
+    padded[pad:pad + len(audio)] = audio
+    resampled = np.empty(count * out_block, np.float32)
+    for index in range(count):
+        spectrum = np.fft.rfft(padded[index * block:(index + 1) * block + 2 * pad])
+        chunk = np.fft.irfft(spectrum[:size // 2 + 1], size) * (size / (block + 2 * pad))
+        resampled[index * out_block:(index + 1) * out_block] = chunk[out_pad:out_pad + out_block]
+    return resampled[:round(len(audio) * sr / orig_sr)]
+
+
+def decode_wav(data, sr=SAMPLE_RATE):
+    """Decode an integer PCM WAV file in process into a mono float32 array at the given sample rate."""
+    with wave.open(io.BytesIO(data)) as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(frames, np.uint8).astype(np.float32) - 128) / 128
+    elif width == 3:
+        # Widen 24-bit samples to int32 by placing them in the top three bytes.
+        raw = np.frombuffer(frames, np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(raw), 4), np.uint8)
+        padded[:, 1:] = raw
+        samples = padded.view("<i4").ravel().astype(np.float32) / 2 ** 31
+    elif width in (2, 4):
+        dtype = np.dtype(f"<i{width}")
+        samples = np.frombuffer(frames, dtype).astype(np.float32) / 2 ** (8 * width - 1)
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width} bytes")
+
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return resample(samples, rate, sr)
+
+
+# ffmpeg output options for the codecs audio can be uploaded in while it is recorded.
+STREAM_CODECS = {
+    "flac": ["-c:a", "flac", "-f", "flac"],
+    "opus": ["-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg", "-flush_packets", "1"],
+}
+
+
+class FFmpegPipe:
+    """ffmpeg process fed and drained by background threads, so input can be written as it arrives.
+
+    Each output chunk is passed to on_output as soon as ffmpeg produces it, or
+    collected and returned by finish when no callback is given.
+    """
+
+    def __init__(self, args, on_output=None, read_size=16384):
+        self.process = subprocess.Popen(
+            ["ffmpeg", "-loglevel", "error", *args], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self.read_size = read_size
+        self.outputs = []
+        self.on_output = on_output or self.outputs.append
+        self.inputs = queue.Queue()
+        self.writer = threading.Thread(target=self.write_inputs, daemon=True)
+        self.reader = threading.Thread(target=self.read_outputs, daemon=True)
+        self.writer.start()
+        self.reader.start()
+
+    def write_inputs(self):
+        try:
+            while (data := self.inputs.get()) is not None:
+                self.process.stdin.write(data)
+        except OSError:
+            # ffmpeg exited early; finish reports its exit status.
+            pass
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def read_outputs(self):
+        while chunk := self.process.stdout.read1(self.read_size):
+            self.on_output(chunk)
+
+    def feed(self, data):
+        """Queue bytes for ffmpeg without blocking the caller."""
+        self.inputs.put(bytes(data))
+
+    def finish(self):
+        """Close ffmpeg's input, wait for all its output and return what was collected."""
+        self.inputs.put(None)
+        self.writer.join()
+        self.reader.join()
+        if self.process.wait():
+            raise subprocess.CalledProcessError(self.process.returncode, "ffmpeg")
+        return b"".join(self.outputs)
+
+    def kill(self):
+        self.process.kill()
+        self.inputs.put(None)
+
+
+def encode_stream(codec, on_output, sr=SAMPLE_RATE):
+    """Start encoding mono 16-bit PCM fed to the returned pipe into codec, passing on each encoded chunk."""
+    return FFmpegPipe(["-f", "s16le", "-ar", str(sr), "-ac", "1", "-i", "pipe:0", *STREAM_CODECS[codec], "pipe:1"],
+                      on_output)
+
+
+def decode_stream(sr=SAMPLE_RATE):
+    """Start decoding an encoded stream fed to the returned pipe into mono 16-bit PCM."""
+    return FFmpegPipe(["-i", "pipe:0", "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr), "pipe:1"])
+
+
+def load_audio_bytes(data, sr=SAMPLE_RATE):
+    """Decode an in-memory audio file into a mono float32 array without writing it to disk.
+
+    Integer PCM WAV files, such as the frontend's recordings, are decoded in
+    process; everything else goes through ffmpeg.
+    """
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        try:
+            return decode_wav(bytes(data), sr)
+        except (wave.Error, EOFError, ValueError):
+            # Float and compressed WAV encodings are left to ffmpeg.
+            pass
+
+    try:
+        pcm = run_ffmpeg("pipe:0", sr, data=bytes(data))
+    except subprocess.CalledProcessError:
+        # Containers such as MP4/M4A keep their index at the end of the file and
+        # cannot be demuxed from a pipe, so hand ffmpeg a seekable temp file instead.
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            temp_file.write(data)
+        try:
+            pcm = run_ffmpeg(temp_file.name, sr)
+        finally:
+            os.unlink(temp_file.name)
+    return np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+
+
+def split_windows(audio, sr=SAMPLE_RATE, window_seconds=30, search_seconds=5, frame_seconds=0.1):
+    """Split audio into (start, end) sample ranges no longer than one Whisper window.
+
+    Each boundary is placed in the quietest short frame of the last few seconds
+    before the window limit, so cuts land in pauses rather than mid-word.
+    """
+    window = int(window_seconds * sr)
+    search = int(search_seconds * sr)
+    frame = int(frame_seconds * sr)
+    bounds = []
+    start = 0
+    while len(audio) - start > window:
+        search_start = start + window - search
+        frames = audio[search_start:search_start + search - search % frame].reshape(-1, frame)
+        energy = np.square(frames).mean(axis=1)
+        cut = search_start + int(np.argmin(energy)) * frame + frame // 2
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, len(audio)))
+    return bounds
+
+
+def speech_regions(audio, sr=SAMPLE_RATE, frame_seconds=0.03, margin_db=12, min_db=-55, max_floor_db=-50,
+                   max_flatness=0.5, min_silence_seconds=0.5, min_speech_seconds=0.1, pad_seconds=0.2):
+    """Return the (start, end) sample ranges of audio that contain speech.
+
+    A frame counts as speech when its energy is margin_db above the clip's
+    noise floor and its spectrum is not flat like broadband noise. The floor
+    is capped at max_floor_db, since a clip with little silence has speech in
+    its quietest frames. A clip whose energy barely varies is all speech
+    unless it is below min_db throughout. Gaps shorter than
+    min_silence_seconds are bridged, blips shorter than min_speech_seconds
+    dropped, and each region padded on both sides.
+    """
+    frame = int(frame_seconds * sr)
+    count = len(audio) // frame
+    if not count:
+        return []
+    frames = audio[:count * frame].reshape(count, frame).astype(np.float32)
+    if np.issubdtype(audio.dtype, np.integer):
+        frames /= np.iinfo(audio.dtype).max + 1
+
+    energy_db = 10 * np.log10(np.square(frames).mean(axis=1) + 1e-10)
+    floor = np.percentile(energy_db, 10)
+    if energy_db.max() - floor < margin_db:
+        return [(0, len(audio))] if energy_db.max() > min_db else []
+    threshold = max(min(floor, max_floor_db) + margin_db, min_db)
+    power = np.square(np.abs(np.fft.rfft(frames * np.hanning(frame), axis=1))) + 1e-12
+    flatness = np.exp(np.log(power).mean(axis=1)) / power.mean(axis=1)
+    active = (energy_db > threshold) & (flatness < max_flatness)
+
+    edges = np.diff(np.concatenate([[0], active.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_silence = min_silence_seconds / frame_seconds
+    regions = []
+    for start, end in zip(starts, ends):
+        if regions and start - regions[-1][1] < min_silence:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    pad = int(pad_seconds * sr)
+    return [
+        (max(0, int(start) * frame - pad), min(len(audio), int(end) * frame + pad))
+        for start, end in regions
+        if (end - start) * frame_seconds >= min_speech_seconds
+    ]
+
+
+def speech_windows(audio, sr=SAMPLE_RATE, window_seconds=30, **vad_options):
+    """Split the speech in audio into sample ranges no longer than one Whisper window.
+
+    Neighbouring speech regions share a window, pause included, whenever they
+    fit in one, so silence only costs a window when it is long enough to
+    separate them; leading, trailing and all-silent stretches are dropped. If
+    no speech is found the whole clip is split as usual, leaving the verdict
+    to the model rather than answering with an empty transcript.
+    """
+    window = int(window_seconds * sr)
+    regions = speech_regions(audio, sr, **vad_options)
+    if not regions:
+        return split_windows(audio, sr, window_seconds)
+    bounds = []
+    for start, end in regions:
+        if bounds and end - bounds[-1][0] <= window:
+            bounds[-1] = (bounds[-1][0], end)
+            continue
+        bounds.extend(
+            (start + first, start + last)
+            for first, last in split_windows(audio[start:end], sr, window_seconds)
+        )
+    return bounds
+
+
+def trim_silence(audio, sr=SAMPLE_RATE, **vad_options):
+    """Return audio with everything outside its speech regions cut out, or all of it if none are found."""
+    regions = speech_regions(audio, sr, **vad_options)
+    if not regions:
+        return audio
+    return np.concatenate([audio[start:end] for start, end in regions])
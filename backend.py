@@ -1,74 +1,158 @@
+import asyncio
+import dataclasses
 import requests
-import socket
-import json
-import struct
-import whisper
+import queue
 import tempfile
-import os
 import threading
-import socketio
+import time
+import os
+import uuid
+from collections import deque
+import numpy as np
 from pyngrok import ngrok
-from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from audio import STREAM_CODECS, load_audio_bytes, speech_windows, split_windows
+from cache import AudioStore, ResultCache, content_hash
+from delivery import OutputSender
+from discovery import BackendAnnouncer, open_store
+from lazy import LazyModule
+from metrics import REQUEST_TIMINGS, Metrics, SlowRequestProfiler
+from models import ModelRegistry
+from protocol import HEADER, frame_type, pack_frame, read_message, unpack_header
+from scheduler import DecodeBatcher, InferenceScheduler
+from streaming import TOKEN_LISTENER, StreamSession, TokenStream, UploadSession
+from workers import InferenceProcesses
+
 load_dotenv()
 
+# Imported on first use, so the server is listening before torch and whisper have loaded.
+torch = LazyModule("torch")
+whisper = LazyModule("whisper")
+
+# Batcher options value for running the audio encoder instead of a decode.
+ENCODE = "encode"
+# Commands an "analyze" request can combine over one encoder pass.
+ANALYZE_COMMANDS = ("detect_language", "transcribe", "translate")
+
 
 class WhisperServer:
-    def __init__(self, socketio_server, host='localhost', port=65432):
+    def __init__(self, socketio_server, host='localhost', port=65432, workers=2, max_queue=16, torch_threads=None,
+                 batch_window=0.03, max_batch=8, preload_models=("tiny",), max_model_bytes=4 * 1024 ** 3, vad=True,
+                 result_cache_path=None, quantize_models=(), interop_threads=None, outputs=None, metrics_port=None,
+                 profile_sample_rate=0.0, profile_slow_seconds=2.0, profiler="cprofile", processes=0,
+                 model_threads=None):
+        self.started = time.monotonic()
+        self.listening_seconds = None
         self.host = host
         self.port = port
         self.socketio_server = socketio_server
-        self.model = None
-        self.model_name = "tiny"
-        self.sio = socketio.Client()
-        self.setup_socketio()
+        self.model_name = preload_models[0] if preload_models else "tiny"
+        # Anything with OutputSender's send and stats methods can stand in for it, e.g. in benchmarks.
+        self.outputs = outputs or OutputSender(socketio_server)
         self.chunk_size = 8192
-        self.session_id = None
-        self.file_hash_map = {}
-        self.load_model(self.model_name)
+        self.audio_store = AudioStore()
+        self.results = ResultCache(path=result_cache_path)
+        self.decode_batch_size = max_batch
+        # Drop silence before inference unless a request asks for every window with "vad": false.
+        self.vad = vad
+        # Scheduler threads share the cores for mel work; the batcher's single thread runs every model
+        # pass and gets all of them.
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // workers)
+        self.model_threads = model_threads or os.cpu_count() or 1
+        if interop_threads:
+            # Inter-op threads are process-wide and can only be set before torch first uses them.
+            torch.set_num_interop_threads(interop_threads)
+        # With worker processes the scheduler threads only decode audio and wait, so keep one per process.
+        self.scheduler = InferenceScheduler(max(workers, processes), max_queue, initializer=self.init_worker)
+        # whisper.decode installs kv-cache hooks on the shared model, so every forward pass goes
+        # through the batcher's single thread; workers overlap download, ffmpeg and mel work with it.
+        self.batcher = DecodeBatcher(self.run_batch, batch_window, max_batch, initializer=self.init_batcher)
+        self.processes = None
+        if processes:
+            # Worker processes load their own models; this one only loads what live streams use.
+            self.processes = InferenceProcesses(processes, {
+                "batch_window": batch_window, "max_batch": max_batch, "preload_models": preload_models,
+                "max_model_bytes": max_model_bytes, "vad": vad, "quantize_models": quantize_models,
+            })
+            preload_models = ()
+        self.models = ModelRegistry(max_model_bytes, preload=preload_models, quantize=quantize_models)
+        self.streams = {}
+        self.uploads = {}
+        self.upload_stats = {}
+        self.upload_stats_lock = threading.Lock()
+        self.metrics_port = metrics_port
+        # Identifies this server's entry in the backend registry.
+        self.backend_id = uuid.uuid4().hex
+        self.metrics = Metrics()
+        self.metrics.add_collector(self.collect_metrics)
+        # Full stage breakdowns, receive and send included, of the latest requests that asked for timings.
+        self.request_timings = deque(maxlen=10000)
+        self.profiler = None
+        if profile_sample_rate:
+            self.profiler = SlowRequestProfiler(sample_rate=profile_sample_rate, slow_seconds=profile_slow_seconds,
+                                                mode=profiler)
 
-    def setup_socketio(self):
-        try:
-            self.sio.connect(self.socketio_server)
-            print(f"Connected to Socket.IO server at {self.socketio_server}")
-        except Exception as e:
-            print(f"Error connecting to Socket.IO server: {e}")
+    def collect_metrics(self):
+        """Yield the stats kept by the scheduler, batcher, caches and sender as gauges."""
+        sources = {"scheduler": self.scheduler.stats(), "batcher": self.batcher.stats(),
+                   "outputs": self.outputs.stats(), "result_cache": self.results.stats()}
+        if self.processes:
+            sources["processes"] = self.processes.stats()
+        for prefix, stats in sources.items():
+            for key, value in stats.items():
+                if isinstance(value, (int, float)):
+                    yield f"whisper_{prefix}_{key}", {}, value
+        models = self.models.stats()
+        yield "whisper_model_bytes", {}, models["model_bytes"]
+        for name, seconds in models["load_seconds"].items():
+            yield "whisper_model_load_seconds", {"model": name}, seconds
+        for name in models["loaded_models"]:
+            yield "whisper_model_loaded", {"model": name}, 1
 
-    def send_chunked(self, conn, data):
-        """Send data to the client in chunks."""
+    async def send_chunked(self, writer, data):
+        """Send a response, or an interim notice, as one frame."""
         try:
-            send_json_data = json.dumps(data).encode()
-            size = len(send_json_data)
-            conn.sendall(struct.pack('!I', size))
-            conn.sendall(send_json_data)
+            with self.metrics.span("send"):
+                frame = pack_frame(frame_type(data), data)
+                writer.write(frame)
+                await writer.drain()
+            self.metrics.inc("whisper_sent_bytes_total", len(frame))
         except Exception as e:
             print(f"Error in send_chunked: {e}")
             raise
 
-    def receive_chunked(self, conn):
-        """Receive data from the client in chunks."""
+    async def receive_chunked(self, reader):
+        """Receive a message and the raw payload, such as inline audio, that follows its body."""
         try:
-            size_data = conn.recv(4)
-            if not size_data:
-                return None
-            total_size = struct.unpack('!I', size_data)[0]
-            data = conn.recv(total_size)
-            if not data:
-                return None
-            return json.loads(data)
+            _, codec, request_id, body_size, payload_size = unpack_header(await reader.readexactly(HEADER.size))
+            # Timed from the header on, so idle time between requests is not counted.
+            with self.metrics.span("receive"):
+                message = read_message(codec, request_id, await reader.readexactly(body_size))
+                audio_data = await reader.readexactly(payload_size) if payload_size else None
+            self.metrics.inc("whisper_received_bytes_total", HEADER.size + body_size + payload_size)
+            return message, audio_data
+        except asyncio.IncompleteReadError:
+            return None, None
         except Exception as e:
             print(f"Error in receive_chunked: {e}")
-            return None
+            return None, None
 
-    def load_model(self, model_name):
-        try:
-            if not self.model or self.model_name != model_name:
-                self.model = whisper.load_model(model_name)
-                self.model_name = model_name
-            return {"status": "success", "message": f"Loaded {model_name} model successfully"}
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+    def init_worker(self):
+        torch.set_num_threads(self.torch_threads)
+
+    def init_batcher(self):
+        torch.set_num_threads(self.model_threads)
+
+    async def load_model(self, writer, model_name, request_id=None):
+        """Return the named model, telling the client to wait if it has to be loaded first."""
+        future = self.models.get(model_name)
+        if not future.done():
+            # A model that has loaded but is still running its warm-up decode is only moments away.
+            stage = self.models.stage(model_name)
+            message = f"Warming up {model_name} model..." if stage == "warming" else f"Loading {model_name} model..."
+            await self.send_chunked(writer, {"status": stage, "request_id": request_id, "message": message})
+        return await asyncio.wrap_future(future)
 
     def download_audio(self, audio_url):
         """Download audio file from the provided URL."""
@@ -83,112 +167,676 @@ class WhisperServer:
             print(f"Error downloading audio file: {e}")
             return None
 
-    def send_output(self, mode, content):
-        mode = {"document": "pentest-vui", "chat": "chat", "create": "pentest-vui"}[mode]
-        try:
-            self.sio.emit(mode, {"session_id": "SESSION", "message": content})
-            print(f"Sent event '{mode}' with content to Socket.IO server")
-        except Exception as e:
-            print(f"Error sending event to Socket.IO server: {e}")
+    def send_output(self, mode, content, session_id, partial=False):
+        """Queue content for the Socket.IO server; delivery happens off the request path.
+
+        Partial outputs are pieces of a transcript still being decoded; the
+        complete text follows as a normal output once decoding finishes.
+        """
+        event = {"document": "pentest-vui", "chat": "chat", "create": "pentest-vui"}[mode]
+        with self.metrics.span("emit"):
+            self.outputs.send(event, {"session_id": session_id, "message": content, "partial": partial})
+
+    def load_audio(self, message, audio_data=None, handle=None):
+        """Return the stored audio a message refers to, decoding it only on first upload.
+
+        handle is the content hash of audio_data when the caller already has it.
+        """
+        if "audio_handle" in message:
+            entry = self.audio_store.get(message["audio_handle"])
+            if entry is None:
+                raise LookupError("Unknown audio handle")
+            return entry
+
+        if audio_data is None:
+            with self.metrics.span("download"):
+                temp_path = self.download_audio(message.get("audio_url"))
+            if not temp_path:
+                raise RuntimeError("Failed to download audio file")
+            try:
+                with open(temp_path, 'rb') as f:
+                    audio_data = f.read()
+            finally:
+                os.unlink(temp_path)
+
+        with self.metrics.span("audio_decode"):
+            return self.audio_store.add(audio_data, self.decode_upload, handle)
+
+    def decode_upload(self, data):
+        """Decode audio sent in one go, recording it in the upload stats next to the streamed codecs."""
+        started = time.monotonic()
+        audio = load_audio_bytes(data)
+        self.record_upload("wav" if data[:4] == b"RIFF" else "file", len(data),
+                           len(audio) / whisper.audio.SAMPLE_RATE, time.monotonic() - started)
+        return audio
+
+    def record_upload(self, codec, size, duration, ready_seconds):
+        """Add an upload to the stats of its codec.
+
+        ready_seconds is the time from its last byte arriving until its audio
+        was decoded and stored, which is what the upload adds to the request.
+        """
+        with self.upload_stats_lock:
+            stats = self.upload_stats.setdefault(codec, {"uploads": 0, "bytes": 0, "audio_seconds": 0.0,
+                                                         "ready_seconds": 0.0})
+            stats["uploads"] += 1
+            stats["bytes"] += size
+            stats["audio_seconds"] += duration
+            stats["ready_seconds"] += ready_seconds
+
+    def upload_stats_snapshot(self):
+        with self.upload_stats_lock:
+            return {codec: dict(stats) for codec, stats in self.upload_stats.items()}
+
+    def window_bounds(self, audio, vad):
+        """Return the sample ranges of audio to decode, keeping only its speech if vad is set."""
+        with self.metrics.span("vad" if vad else "split"):
+            return speech_windows(audio) if vad else split_windows(audio)
 
-    def detect_language(self, audio_url):
-        """Detect the language of the uploaded audio file."""
-        temp_path = self.download_audio(audio_url)
-        if not temp_path:
-            return {"status": "error", "message": "Failed to download audio file"}
+    def window_mels(self, audio, bounds, n_mels):
+        """Return the mel spectrograms of the given windows of audio as one batch tensor."""
+        if not bounds:
+            return torch.zeros((0, n_mels, whisper.audio.N_FRAMES))
+        # Each window is normalised on its own, exactly as a single 30-second clip would be.
+        with self.metrics.span("mel"):
+            return torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(audio[start:end]), n_mels)
+                for start, end in bounds
+            ])
 
+    def get_window_mels(self, entry, model, vad):
+        """Return the windows of an entry and their mel spectrograms, computed once per mel size."""
+        n_mels = model.dims.n_mels
+        bounds = self.window_bounds(entry.audio, vad)
+        mels = self.audio_store.get_mel(entry, (n_mels, vad), lambda audio: self.window_mels(audio, bounds, n_mels))
+        return bounds, mels
+
+    def timestamped_segments(self, tokens, tokenizer, offset, end):
+        """Split decoded tokens into text segments using the timestamp tokens between them."""
+        segments = []
+        start = 0.0
+        text_tokens = []
+        for token in tokens:
+            if token < tokenizer.timestamp_begin:
+                text_tokens.append(token)
+                continue
+            seconds = (token - tokenizer.timestamp_begin) * 0.02
+            if text_tokens:
+                segments.append({"start": offset + start, "end": offset + seconds,
+                                 "text": tokenizer.decode(text_tokens).strip()})
+                text_tokens = []
+            start = seconds
+        if text_tokens:
+            segments.append({"start": offset + start, "end": end, "text": tokenizer.decode(text_tokens).strip()})
+        return segments
+
+    def run_batch(self, key, jobs):
+        """Run the inputs of several requests through the model in one pass.
+
+        Jobs under the ENCODE key are mel spectrograms and yield audio features;
+        language detection and decoding jobs take those features.
+        """
+        model, options = key
+        inputs = torch.cat(jobs).to(model.device)
+        # Features are fp16 on the GPU and fp32 on the CPU, where whisper cannot run in half precision.
+        fp16 = model.device.type == "cuda"
+        with torch.inference_mode():
+            if options is None:
+                _, outputs = model.detect_language(inputs)
+            elif options == ENCODE:
+                outputs = model.embed_audio(inputs.half() if fp16 else inputs)
+            elif isinstance(options, TokenStream):
+                task = whisper.decoding.DecodingTask(model, dataclasses.replace(options.options, fp16=fp16))
+                task.logit_filters.append(options)
+                outputs = task.run(inputs)
+            else:
+                outputs = whisper.decode(model, inputs, dataclasses.replace(options, fp16=fp16))
+
+        results = []
+        for job in jobs:
+            results.append(outputs[:len(job)])
+            outputs = outputs[len(job):]
+        return results
+
+    def encode_windows(self, mels, model):
+        """Run the audio encoder over window mel spectrograms in batches and return their features."""
+        if not len(mels):
+            return mels
+        with self.metrics.span("encode"):
+            futures = [
+                self.batcher.submit((model, ENCODE), mels[first:first + self.decode_batch_size])
+                for first in range(0, len(mels), self.decode_batch_size)
+            ]
+            return torch.cat([future.result() for future in futures])
+
+    def get_tokenizer(self, model, options):
+        return whisper.tokenizer.get_tokenizer(
+            model.is_multilingual, num_languages=model.num_languages, task=options.task
+        )
+
+    def decode_results(self, features, model, options, tokenizer, results):
+        """Decode encoded windows in batches and append their results to those of the windows before them."""
+        on_text = TOKEN_LISTENER.get()
+        with self.metrics.span(options.task):
+            if on_text is not None:
+                self.stream_windows(features, model, options, tokenizer, on_text, results)
+            else:
+                futures = [
+                    self.batcher.submit((model, options), features[first:first + self.decode_batch_size])
+                    for first in range(0, len(features), self.decode_batch_size)
+                ]
+                results.extend(result for future in futures for result in future.result())
+
+    def stitch_windows(self, bounds, results, tokenizer):
+        """Join the decoded windows of audio into its text and timestamped segments."""
+        sample_rate = whisper.audio.SAMPLE_RATE
+        texts = []
+        segments = []
+        for (start, end), result in zip(bounds, results):
+            texts.append(result.text)
+            segments.extend(self.timestamped_segments(
+                result.tokens, tokenizer, start / sample_rate, end / sample_rate
+            ))
+        return " ".join(text for text in texts if text), segments
+
+    def decode_windows(self, bounds, features, model, options):
+        """Decode the encoded windows of audio in batches and stitch the results with timestamps.
+
+        Returns the joined text, the timestamped segments and the language of the first window.
+        """
+        tokenizer = self.get_tokenizer(model, options)
+        results = []
+        self.decode_results(features, model, options, tokenizer, results)
+        text, segments = self.stitch_windows(bounds, results, tokenizer)
+        language = results[0].language if results else options.language
+        return text, segments, language
+
+    def stream_windows(self, features, model, options, tokenizer, on_text, results):
+        """Decode windows one at a time and in order, passing on their text as the tokens are picked.
+
+        Windows are not batched with each other or with other requests, which
+        costs throughput but lets the first words reach the client early.
+        """
+        for index in range(len(features)):
+            prefix = " " if any(result.text for result in results) else ""
+            stream = TokenStream(options, tokenizer, on_text, prefix)
+            result = self.batcher.submit((model, stream), features[index:index + 1]).result()[0]
+            stream.update(result.tokens)
+            results.append(result)
+
+    def detect_language(self, features, model):
+        """Detect the language of the uploaded audio from its first window."""
         try:
-            audio = whisper.load_audio(temp_path)
-            audio = whisper.pad_or_trim(audio)
-            mel = whisper.log_mel_spectrogram(audio).to(self.model.device)
-            _, probs = self.model.detect_language(mel)
+            if not len(features):
+                return {"status": "error", "message": "No speech detected"}
+            with self.metrics.span("language"):
+                probs = self.batcher.submit((model, None), features[:1]).result()[0]
             detected_lang = max(probs, key=probs.get)
             return {"status": "success", "language": detected_lang}
         except Exception as e:
             return {"status": "error", "message": str(e)}
-        finally:
-            os.unlink(temp_path)
 
-    def transcribe_audio(self, audio_url, mode):
-        """Transcribe the uploaded audio file."""
-        temp_path = self.download_audio(audio_url)
-        if not temp_path:
-            return {"status": "error", "message": "Failed to download audio file"}
+    def run_audio_commands(self, entry, model, commands, mode, session_id, vad, emit=True):
+        """Run several commands on one entry, sharing each encoder pass over its windows.
 
+        Windows are encoded and decoded decode_batch_size at a time, so only
+        the features of one batch of windows are held however long the audio is.
+        """
+        decodes = {command: whisper.DecodingOptions(task=command) for command in commands
+                   if command != "detect_language"}
+        tokenizers = {command: self.get_tokenizer(model, options) for command, options in decodes.items()}
+        decoded = {command: [] for command in decodes}
+        results = {}
         try:
-            audio = whisper.load_audio(temp_path)
-            audio = whisper.pad_or_trim(audio)
-            mel = whisper.log_mel_spectrogram(audio).to(self.model.device)
-            options = whisper.DecodingOptions()
-            result = whisper.decode(self.model, mel, options)
-            self.send_output(mode, result.text)
-            return {"status": "success", "text": result.text}
+            bounds, mels = self.get_window_mels(entry, model, vad)
+            # Language detection only looks at the first window.
+            if not decodes:
+                mels = mels[:1]
+            if "detect_language" in commands and not len(mels):
+                results["detect_language"] = self.detect_language(mels, model)
+            for first in range(0, len(mels), self.decode_batch_size):
+                features = self.encode_windows(mels[first:first + self.decode_batch_size], model)
+                if first == 0 and "detect_language" in commands:
+                    results["detect_language"] = self.detect_language(features, model)
+                for command, options in decodes.items():
+                    if command in results:
+                        continue
+                    # Only the transcript is streamed when one analysis decodes both.
+                    token = TOKEN_LISTENER.set(None) if command != "transcribe" and "transcribe" in decodes else None
+                    try:
+                        self.decode_results(features, model, options, tokenizers[command], decoded[command])
+                    except Exception as e:
+                        results[command] = {"status": "error", "message": str(e)}
+                    finally:
+                        if token is not None:
+                            TOKEN_LISTENER.reset(token)
         except Exception as e:
-            return {"status": "error", "message": str(e)}
-        finally:
-            os.unlink(temp_path)
+            error = {"status": "error", "message": str(e)}
+            return {command: results.get(command, error) for command in commands}
+
+        for command in decodes:
+            if command in results:
+                continue
+            text, segments = self.stitch_windows(bounds, decoded[command], tokenizers[command])
+            if command == "transcribe" and text and emit:
+                self.send_output(mode, text, session_id)
+            results[command] = {"status": "success", "text": text, "segments": segments}
+        return {command: results[command] for command in commands}
+
+    def analyze_entry(self, entry, model, commands, mode, session_id, vad, emit=True):
+        """Run commands on an entry here, or in a worker process if there are any; model is then its name."""
+        if self.processes is None:
+            return self.run_audio_commands(entry, model, commands, mode, session_id, vad, emit)
+        try:
+            results = self.processes.run(entry, model, commands, {"mode": mode, "session_id": session_id, "vad": vad})
+        except Exception as e:
+            return {command: {"status": "error", "message": str(e)} for command in commands}
+        transcript = results.get("transcribe", {})
+        if emit and transcript.get("status") == "success" and transcript["text"]:
+            self.send_output(mode, transcript["text"], session_id)
+        return results
+
+    def result_key(self, handle, command, message, vad):
+        """Return the result cache key of a command; everything that changes its output is part of it."""
+        model_name = message.get("model_name") or self.model_name
+        # Quantized weights give slightly different text, so a restart with other settings must not reuse it.
+        quantized = model_name in self.models.quantize
+        return f"{handle}:{model_name}:{quantized}:{command}:{message.get('language')}:{vad}"
+
+    def audio_commands(self, command, message):
+        """Return the commands a request runs; "analyze" runs those listed in its "outputs"."""
+        if command == "analyze":
+            return [name for name in message.get("outputs", ANALYZE_COMMANDS) if name in ANALYZE_COMMANDS]
+        return [command]
+
+    def cached_results(self, commands, handle, message):
+        """Return the cached responses of the commands that have one."""
+        vad = message.get("vad", self.vad)
+        results = {}
+        for name in commands:
+            cached = self.results.get(self.result_key(handle, name, message, vad))
+            if cached is not None:
+                results[name] = {**cached, "cached": True}
+        return results
+
+    def forward_cached(self, results, message):
+        """Forward a cached transcript to Socket.IO, as running the command would have."""
+        transcript = results.get("transcribe")
+        if transcript and transcript["text"] and message.get("emit", True):
+            self.send_output(message.get("mode", "document"), transcript["text"], message.get("session_id"))
+
+    def audio_response(self, command, results, handle):
+        if command == "analyze":
+            return {"status": "success", "results": results, "audio_handle": handle}
+        return {**results[command], "audio_handle": handle}
+
+    def cached_response(self, command, message, audio_data):
+        """Return the audio handle of a request, its cached results and its response if all of them are cached.
+
+        Runs before the request is queued, so repeated requests are answered
+        without waiting behind inference jobs or loading the model; the handle
+        and the results found are passed on so a miss is not looked up again.
+        """
+        handle = message.get("audio_handle") or (content_hash(audio_data) if audio_data is not None else None)
+        if handle is None:
+            return None, {}, None
+        commands = self.audio_commands(command, message)
+        results = self.cached_results(commands, handle, message)
+        if len(results) < len(commands):
+            return handle, results, None
+        self.forward_cached(results, message)
+        return handle, results, self.audio_response(command, results, handle)
+
+    def handle_audio_command(self, command, message, audio_data, model, handle=None, cached=None):
+        """Resolve the audio attached to a message and run the requested command on it.
 
-    def translate_audio(self, audio_url, mode):
-        """Translate the uploaded audio file."""
-        temp_path = self.download_audio(audio_url)
-        if not temp_path:
-            return {"status": "error", "message": "Failed to download audio file"}
+        "analyze" runs every command listed in the message's "outputs" at once
+        and returns their responses under "results"; "emit": false keeps its
+        transcript from being forwarded. Results are cached by audio content,
+        so a repeated command is answered without decoding the audio or running
+        the model again; cached holds the results already looked up for handle.
+        Successful responses carry the audio's duration in seconds.
+        """
+        mode = message.get("mode", "document")
+        session_id = message.get("session_id")
+        vad = message.get("vad", self.vad)
+        emit = message.get("emit", True)
+        commands = self.audio_commands(command, message)
 
+        results = {}
+        if cached is not None:
+            results = dict(cached)
+        elif handle is None and command != "upload_audio":
+            handle = message.get("audio_handle") or (content_hash(audio_data) if audio_data is not None else None)
+            if handle:
+                results = self.cached_results(commands, handle, message)
+        self.forward_cached(results, message)
+
+        missing = [name for name in commands if name not in results]
+        if missing:
+            try:
+                entry = self.load_audio(message, audio_data, handle)
+            except LookupError as e:
+                return {"status": "error", "code": "unknown_audio_handle", "message": str(e)}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+            handle = entry.handle
+            duration = len(entry.audio) / whisper.audio.SAMPLE_RATE
+
+            if command == "upload_audio":
+                return {"status": "success", "duration": duration, "audio_handle": handle}
+
+            for name, response in self.analyze_entry(entry, model, missing, mode, session_id, vad, emit).items():
+                if response["status"] == "success":
+                    response = {**response, "duration": duration}
+                    self.results.put(self.result_key(handle, name, message, vad), response)
+                results[name] = response
+
+        return self.audio_response(command, results, handle)
+
+    def decode_stream(self, session, final=False):
+        """Decode the uncommitted audio of a live stream and commit the parts that have settled."""
+        audio = session.window()
+        segments = []
+        if len(audio):
+            bounds = split_windows(audio)
+            mels = self.window_mels(audio, bounds, session.model.dims.n_mels)
+            features = self.encode_windows(mels, session.model)
+            _, segments, language = self.decode_windows(bounds, features, session.model, session.options)
+            if session.options.language is None:
+                # Pin the language after the first decode so partials do not flip between languages.
+                session.options = dataclasses.replace(session.options, language=language)
+        return session.update(segments, final)
+
+    def finish_stream(self, session):
+        response = self.decode_stream(session, final=True)
+        if session.options.task == "transcribe":
+            self.send_output(session.mode, response["text"], session.session_id)
+        return response
+
+    def start_stream(self, writer, message, model):
+        stream_id = uuid.uuid4().hex
+        options = whisper.DecodingOptions(task=message.get("task", "transcribe"), language=message.get("language"))
+        self.streams[stream_id] = StreamSession(stream_id, writer, model, options, message.get("mode", "document"),
+                                                message.get("session_id"))
+        return {"status": "success", "stream_id": stream_id}
+
+    def feed_stream(self, message, audio_data):
+        """Append 16 kHz 16-bit PCM to a live stream, starting a decode once enough has arrived."""
+        session = self.streams.get(message.get("stream_id"))
+        if session is None or audio_data is None:
+            return
+        pcm = np.frombuffer(audio_data, np.int16).astype(np.float32) / 32768.0
+        if session.append(pcm):
+            session.task = asyncio.create_task(self.run_stream_decodes(session))
+
+    async def run_stream_decodes(self, session):
+        """Re-decode a live stream and push partial results for as long as new audio keeps arriving."""
+        while True:
+            try:
+                future, _ = self.scheduler.submit(self.decode_stream, session)
+                partial = await asyncio.wrap_future(future)
+                await self.send_chunked(session.writer, partial)
+            except queue.Full:
+                # Skip this refresh; the next one will cover the audio that arrived meanwhile.
+                await asyncio.sleep(0.1)
+            except Exception as e:
+                print(f"Error decoding stream {session.stream_id}: {e}")
+            if not session.finish_decode():
+                break
+
+    async def end_stream(self, message):
+        """Decode what is left of a live stream and return its full transcript."""
+        session = self.streams.pop(message.get("stream_id"), None)
+        if session is None:
+            return {"status": "error", "message": "Unknown stream"}
+        if session.task:
+            await session.task
+        try:
+            future, _ = self.scheduler.submit(self.finish_stream, session)
+        except queue.Full:
+            return {"status": "busy", "message": "Server is busy, please try again shortly"}
+        return await asyncio.wrap_future(future)
+
+    def negotiate(self, message):
+        """Pick the first upload codec the client offers that this server can decode as it arrives."""
+        codec = next((codec for codec in message.get("codecs", []) if codec in STREAM_CODECS), None)
+        return {"status": "success", "codec": codec, "codecs": list(STREAM_CODECS)}
+
+    def start_upload(self, writer, message):
+        codec = message.get("codec")
+        if codec not in STREAM_CODECS:
+            return {"status": "error", "message": f"Unsupported codec: {codec}"}
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = UploadSession(upload_id, writer, codec)
+        return {"status": "success", "upload_id": upload_id}
+
+    def feed_upload(self, message, audio_data):
+        session = self.uploads.get(message.get("upload_id"))
+        if session is not None and audio_data is not None:
+            session.feed(audio_data)
+
+    def finish_upload(self, session):
+        started = time.monotonic()
+        handle, audio = session.finish()
+        entry = self.audio_store.put(handle, audio)
+        duration = len(entry.audio) / whisper.audio.SAMPLE_RATE
+        self.record_upload(session.codec, session.size, duration, time.monotonic() - started)
+        return {"status": "success", "audio_handle": entry.handle, "duration": duration}
+
+    async def end_upload(self, message):
+        """Wait for a streamed upload to finish decoding and store it under its content handle."""
+        session = self.uploads.pop(message.get("upload_id"), None)
+        if session is None:
+            return {"status": "error", "message": "Unknown upload"}
+        try:
+            future, _ = self.scheduler.submit(self.finish_upload, session)
+        except queue.Full:
+            session.decoder.kill()
+            return {"status": "busy", "message": "Server is busy, please try again shortly"}
+        try:
+            response = await asyncio.wrap_future(future)
+        except Exception as e:
+            return {"status": "error", "message": f"Failed to decode {session.codec} upload: {e}"}
+        return {**response, "bytes": session.size}
+
+    def run_command(self, message, audio_data, model, handle=None, cached=None):
+        """Execute a client command on an inference worker."""
+        command = message.get("command")
+        if command not in ("upload_audio", "analyze", *ANALYZE_COMMANDS):
+            return {"status": "error", "message": "Unknown command"}
+        if self.profiler is None:
+            return self.handle_audio_command(command, message, audio_data, model, handle, cached)
+        with self.profiler.capture(command):
+            return self.handle_audio_command(command, message, audio_data, model, handle, cached)
+
+    def token_listener(self, writer, message):
+        """Return a callback that pushes transcript text to the client, and to Socket.IO, as it is decoded."""
+        loop = asyncio.get_running_loop()
+        emit = message.get("command") in ("transcribe", "analyze") and message.get("emit", True)
+
+        def on_text(text):
+            notice = {"status": "partial", "request_id": message.get("request_id"), "text": text}
+            asyncio.run_coroutine_threadsafe(self.send_chunked(writer, notice), loop)
+            if emit:
+                self.send_output(message.get("mode", "document"), text, message.get("session_id"), partial=True)
+
+        return on_text
+
+    async def dispatch(self, writer, message, audio_data):
+        """Queue a command for the inference workers and wait for its response."""
+        request_id = message.get("request_id")
+        command = message.get("command")
+        if command == "server_stats":
+            return {"status": "success", **self.scheduler.stats(), "batching": self.batcher.stats(),
+                    "models": self.models.stats(), "uploads": self.upload_stats_snapshot(),
+                    "result_cache": self.results.stats(), "outputs": self.outputs.stats(),
+                    "processes": self.processes.stats() if self.processes else None,
+                    "listening_seconds": self.listening_seconds}
+        if command == "negotiate":
+            return self.negotiate(message)
+        if command == "upload_start":
+            return self.start_upload(writer, message)
+        if command == "upload_chunk":
+            self.feed_upload(message, audio_data)
+            return None
+        if command == "upload_end":
+            return await self.end_upload(message)
+
+        if command == "stream_audio":
+            self.feed_stream(message, audio_data)
+            return None
+        if command == "stream_end":
+            return await self.end_stream(message)
+
+        handle = None
+        cached = None
+        if command in ("analyze", *ANALYZE_COMMANDS):
+            # Hashing inline audio and reading the on-disk cache stay off the event loop.
+            handle, cached, response = await asyncio.to_thread(self.cached_response, command, message, audio_data)
+            if response is not None:
+                return response
+
+        model_name = message.get("model_name") or self.model_name
         try:
-            audio = whisper.load_audio(temp_path)
-            audio = whisper.pad_or_trim(audio)
-            mel = whisper.log_mel_spectrogram(audio).to(self.model.device)
-            options = whisper.DecodingOptions(task="translate")
-            result = whisper.decode(self.model, mel, options)
-            return {"status": "success", "text": result.text}
+            if self.processes is None or command == "stream_start":
+                model = await self.load_model(writer, model_name, request_id)
+            else:
+                # Worker processes load the model themselves when a job first asks for it.
+                model = model_name
+                if command == "load_model":
+                    await asyncio.gather(*map(asyncio.wrap_future, self.processes.load(model_name)))
         except Exception as e:
             return {"status": "error", "message": str(e)}
-        finally:
-            os.unlink(temp_path)
+        if command == "load_model":
+            return {"status": "success", "message": f"Loaded {model_name} model successfully"}
+        if command == "stream_start":
+            return self.start_stream(writer, message, model)
+
+        streamed = command in ("transcribe", "translate") or (
+            command == "analyze" and "transcribe" in self.audio_commands(command, message))
+        if message.get("stream_tokens") and streamed and self.processes is None:
+            # Set here so the scheduler copies it into the worker's context along with the request timings.
+            TOKEN_LISTENER.set(self.token_listener(writer, message))
+        try:
+            future, position = self.scheduler.submit(self.run_command, message, audio_data, model, handle, cached)
+        except queue.Full:
+            return {"status": "busy", "message": "Server is busy, please try again shortly",
+                    **self.scheduler.stats()}
+
+        if position:
+            await self.send_chunked(writer, {"status": "queued", "position": position, "request_id": request_id,
+                                             "message": f"Server busy, queued at position {position}..."})
+        return await asyncio.wrap_future(future)
+
+    async def process_message(self, writer, message, audio_data):
+        """Run one request and send its response tagged with the request id it came with.
 
-    def handle_client(self, conn, addr):
-        """Handle incoming client connections."""
-        print(f"New connection from {addr}")
+        With "timings": true in the message, the response carries the time in
+        milliseconds the request spent in each pipeline stage. Its own send is
+        only known once it is out, so the breakdown including it and the
+        receive is then added to request_timings.
+        """
+        command = message.get("command")
+        # Holds the receive time of this message already; see handle_client.
+        timings = REQUEST_TIMINGS.get() if message.get("timings") else None
+        # Each message runs in its own task, so this only reaches the stages of this request.
+        REQUEST_TIMINGS.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.dispatch(writer, message, audio_data)
+        except Exception as e:
+            response = {"status": "error", "message": str(e)}
+        elapsed = time.perf_counter() - started
+        label = command or "unknown"
+        self.metrics.inc("whisper_requests_total", command=label)
+        self.metrics.observe("whisper_request_seconds", elapsed, command=label)
+        if response is None:
+            return
+        if response.get("status") != "success":
+            self.metrics.inc("whisper_errors_total", command=label, status=response.get("status"))
+        if timings is not None:
+            response = {**response, "timings": {**timings, "total": 1000 * elapsed}}
+        if "request_id" in message:
+            response = {**response, "request_id": message["request_id"]}
+        try:
+            await self.send_chunked(writer, response)
+        except Exception as e:
+            print(f"Error sending response: {e}")
+            return
+        if timings is not None:
+            self.request_timings.append({**timings, "total": 1000 * elapsed})
+
+    async def handle_client(self, reader, writer):
+        """Handle incoming client connections.
+
+        Each message is processed in its own task, so a client can pipeline
+        several requests on one socket and receive the responses as they finish.
+        """
+        addr = writer.get_extra_info("peername")
+        # Outputs are tagged with the client's session id, or one made up for this connection.
+        session_id = uuid.uuid4().hex
+        print(f"New connection from {addr} (session {session_id})")
+        self.metrics.inc("whisper_connections_total")
+        self.metrics.add("whisper_active_connections", 1)
+        tasks = set()
         while True:
             try:
-                message = self.receive_chunked(conn)
+                # A fresh breakdown per message picks up its receive span; the task below inherits it.
+                REQUEST_TIMINGS.set({})
+                message, audio_data = await self.receive_chunked(reader)
                 if not message:
                     break
+                message.setdefault("session_id", session_id)
 
-                command = message.get("command")
-                audio_url = message.get("audio_url")
-                mode = message.get("mode", "document")
-
-                if command == "load_model":
-                    response = self.load_model(message["model_name"])
-                elif command == "detect_language":
-                    response = self.detect_language(audio_url)
-                elif command == "transcribe":
-                    response = self.transcribe_audio(audio_url, mode)
-                elif command == "translate":
-                    response = self.translate_audio(audio_url, mode)
-                else:
-                    response = {"status": "error", "message": "Unknown command"}
-
-                self.send_chunked(conn, response)
+                task = asyncio.create_task(self.process_message(writer, message, audio_data))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
 
             except Exception as e:
                 print(f"Error handling client: {e}")
                 break
 
-        conn.close()
+        for task in tasks:
+            task.cancel()
+        for stream_id, session in list(self.streams.items()):
+            if session.writer is writer:
+                del self.streams[stream_id]
+        for upload_id, session in list(self.uploads.items()):
+            if session.writer is writer:
+                session.decoder.kill()
+                del self.uploads[upload_id]
+        writer.close()
+        self.metrics.add("whisper_active_connections", -1)
         print(f"Connection closed from {addr}")
 
+    async def serve(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.listening_seconds = time.monotonic() - self.started
+        print(f"TCP server listening on {self.host}:{self.port} {self.listening_seconds:.2f}s after startup")
+        if self.metrics_port:
+            # Metrics stay on the local interface; only the TCP protocol port is tunnelled.
+            self.metrics_server = await asyncio.start_server(self.metrics.handle_http, "localhost", self.metrics_port)
+            print(f"Metrics available at http://localhost:{self.metrics_port}/metrics")
+        async with self.server:
+            await self.server.serve_forever()
+
     def start_tcp_server(self):
         """Start the TCP server."""
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind((self.host, self.port))
-        self.server.listen()
-        print(f"TCP server listening on {self.host}:{self.port}")
-        while True:
-            conn, addr = self.server.accept()
-            thread = threading.Thread(target=self.handle_client, args=(conn, addr))
-            thread.start()
+        asyncio.run(self.serve())
+
+    def describe_backend(self, hostname, port):
+        """Return the address, capacity and current load published in this backend's registry entry."""
+        scheduler = self.scheduler.stats()
+        return {
+            "url": hostname,
+            "port": port,
+            "capacity": scheduler["workers"],
+            "max_queue": scheduler["max_queue"],
+            "active_jobs": scheduler["active_jobs"],
+            "queue_depth": scheduler["queue_depth"],
+            "models": self.models.stats()["loaded_models"],
+        }
 
     def start_localtunnel(self):
         print("Starting localtunnel...")
@@ -197,28 +845,26 @@ class WhisperServer:
         hostname = url_parts[0]
         port = int(url_parts[1])
 
-        # MongoDB connection
+        # Register alongside other backends instead of replacing the single ngrok document
         try:
-            mongo_client = MongoClient(os.getenv("MONGO_URI"))
-            db = mongo_client["PROJECT"]
-            ngrok_collection = db["ngrok"]
-
-            # Clear the collection and insert the new document
-            ngrok_collection.delete_many({})
-            ngrok_collection.insert_one({
-                "url": hostname,
-                "port": port
-            })
-            print(f"Updated MongoDB with Ngrok URL: {hostname} and port: {port}")
+            self.announcer = BackendAnnouncer(open_store(), self.backend_id,
+                                              lambda: self.describe_backend(hostname, port))
+            self.announcer.start()
+            print(f"Registered backend {self.backend_id} at {hostname}:{port}")
         except Exception as e:
-            print(f"Error updating MongoDB: {e}")
+            print(f"Error registering backend: {e}")
 
     def start(self):
-        # Start localtunnel in the main thread
-        self.start_localtunnel()
-        self.start_tcp_server()
+        # Open the tunnel and register in the background so the listener does not wait on ngrok and MongoDB
+        threading.Thread(target=self.start_localtunnel, name="localtunnel", daemon=True).start()
+        try:
+            self.start_tcp_server()
+        finally:
+            if getattr(self, "announcer", None):
+                self.announcer.stop()
 
 
 if __name__ == "__main__":
-    server = WhisperServer(socketio_server="http://someotherwebsite.com")
+    server = WhisperServer(socketio_server="http://someotherwebsite.com", result_cache_path="results.sqlite3",
+                           metrics_port=9100)
     server.start()
@@ -0,0 +1,188 @@
+"""Transcribe a directory or manifest of audio files through a WhisperServer without the GUI.
+
+Usage: python batch.py INPUT --output results.jsonl [--srt-dir subtitles] [--in-flight 4]
+
+INPUT is a directory, searched recursively for audio files, or a manifest
+listing one audio path per line. Files are sent inline with the same
+commands the GUI uses, with up to --in-flight requests outstanding on one
+connection. Every result is appended to the JSONL output as soon as it
+arrives, and optionally written as an .srt file; the output doubles as the
+checkpoint, so running the same command again skips files already done.
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+from audio import AUDIO_EXTENSIONS
+from client import WhisperConnection
+from discovery import BackendDirectory
+
+
+def list_inputs(path):
+    """Return the audio files under a directory, or the paths listed in a manifest file."""
+    if os.path.isdir(path):
+        files = []
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, name) for name in names
+                         if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS)
+        return sorted(files)
+    base = os.path.dirname(path)
+    with open(path) as f:
+        return [os.path.join(base, line.strip()) for line in f if line.strip() and not line.startswith("#")]
+
+
+def completed_files(output):
+    """Return the files an earlier run already transcribed successfully."""
+    done = set()
+    try:
+        with open(output) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line of an interrupted run may be cut short.
+                    continue
+                if record.get("status") == "success":
+                    done.add(record["file"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def srt_timestamp(seconds):
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+def write_srt(path, segments):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        for number, segment in enumerate(segments, 1):
+            f.write(f"{number}\n{srt_timestamp(segment['start'])} --> {srt_timestamp(segment['end'])}\n"
+                    f"{segment['text']}\n\n")
+
+
+class BatchRun:
+    """Feeds files to one connection from several threads and records results as they finish."""
+
+    def __init__(self, connection, files, args):
+        self.connection = connection
+        self.args = args
+        self.files = queue.Queue()
+        for path in files:
+            self.files.put(path)
+        self.total = len(files)
+        self.output = open(args.output, "a")
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.finished = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+
+    def transcribe(self, data):
+        """Send one file's contents, waiting and resending while the server is too busy to queue it."""
+        while True:
+            response = self.connection.request(self.args.command, data, model_name=self.args.model,
+                                               emit=self.args.emit).result()
+            if response.get("status") != "busy":
+                return response
+            time.sleep(self.args.retry_delay)
+
+    def record(self, path, response, elapsed):
+        record = {"file": path, "status": response.get("status"), "elapsed": elapsed}
+        if response.get("status") == "success":
+            record.update(text=response["text"], segments=response["segments"], duration=response.get("duration"))
+        else:
+            record["message"] = response.get("message")
+        with self.lock:
+            self.output.write(json.dumps(record) + "\n")
+            self.output.flush()
+            self.finished += 1
+            if record["status"] == "success":
+                self.audio_seconds += record["duration"] or 0.0
+            else:
+                self.failed += 1
+            print(f"[{self.finished}/{self.total}] {path}: {record['status']} ({elapsed:.1f}s)")
+
+        if record["status"] == "success" and self.args.srt_dir:
+            relative = os.path.relpath(path, self.args.input if os.path.isdir(self.args.input) else
+                                       os.path.dirname(self.args.input))
+            write_srt(os.path.join(self.args.srt_dir, os.path.splitext(relative)[0] + ".srt"), record["segments"])
+
+    def worker(self):
+        while not self.stopped.is_set():
+            try:
+                path = self.files.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                # Recorded as failed so later runs retry it without stopping on it.
+                self.record(path, {"status": "error", "message": f"Could not read file: {e}"}, 0.0)
+                continue
+            try:
+                response = self.transcribe(data)
+            except OSError as e:
+                # Includes a dropped connection; what is left is picked up by the next run.
+                print(f"Stopping batch after error on {path}: {e}")
+                self.stopped.set()
+                return
+            self.record(path, response, time.perf_counter() - started)
+
+    def run(self):
+        threads = [threading.Thread(target=self.worker) for _ in range(self.args.in_flight)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.output.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="directory of audio files, or a manifest with one path per line")
+    parser.add_argument("--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--srt-dir", help="also write an .srt subtitle file per input here")
+    parser.add_argument("--in-flight", type=int, default=4, help="requests outstanding at once")
+    parser.add_argument("--command", default="transcribe", choices=["transcribe", "translate"])
+    parser.add_argument("--model", default=None, help="model name (default: the server's)")
+    parser.add_argument("--emit", action="store_true", help="forward transcripts to Socket.IO like the GUI")
+    parser.add_argument("--retry-delay", type=float, default=1.0, help="seconds to wait when the server is busy")
+    parser.add_argument("--host", help="server to use instead of the least loaded one in the registry")
+    parser.add_argument("--port", type=int, default=65432)
+    args = parser.parse_args()
+
+    files = list_inputs(args.input)
+    done = completed_files(args.output)
+    todo = [path for path in files if path not in done]
+    print(f"{len(files)} files, {len(files) - len(todo)} already done, {len(todo)} to go")
+    if not todo:
+        return
+
+    if args.host:
+        connection = WhisperConnection(args.host, args.port)
+    else:
+        connection, _ = BackendDirectory().connect(WhisperConnection)
+
+    batch = BatchRun(connection, todo, args)
+    started = time.perf_counter()
+    try:
+        batch.run()
+    finally:
+        connection.close()
+    wall = time.perf_counter() - started
+    print(f"Finished {batch.finished} files ({batch.failed} failed) in {wall:.1f}s: "
+          f"{60 * batch.finished / wall:.1f} files/minute, {batch.audio_seconds / wall:.1f} audio seconds/second")
+
+
+if __name__ == "__main__":
+    main()
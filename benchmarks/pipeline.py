@@ -0,0 +1,184 @@
+"""Replay a directory of audio clips through a local WhisperServer and report throughput and latency.
+
+Usage: python -m benchmarks.pipeline CLIPS_DIR [--connections 4] [--requests 20] [--output run.json]
+
+The server runs in process with ngrok, MongoDB and Socket.IO left out, its
+result cache and audio store disabled, so replayed clips are decoded and
+run again. The simulated clients run in a separate process, each with its
+own connection, and send clips round-robin. The report covers throughput,
+p50/p95/p99 latency end to end and per pipeline stage, receive and send
+included, taken from the breakdowns the server keeps for every request, and
+the server's CPU time and RSS. It is printed as JSON and optionally written
+to a file so runs can be compared across changes.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import threading
+import time
+
+from audio import AUDIO_EXTENSIONS
+from backend import WhisperServer
+from cache import AudioStore, ResultCache
+from client import WhisperConnection
+from delivery import NullSender
+
+
+def percentiles(values):
+    """Return the count, mean and p50/p95/p99 of a list of durations in milliseconds."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def at(fraction):
+        return 1000 * ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {"count": len(ordered), "mean_ms": 1000 * sum(ordered) / len(ordered),
+            "p50_ms": at(0.5), "p95_ms": at(0.95), "p99_ms": at(0.99)}
+
+
+def rss_bytes():
+    """Return the current resident set size of this process (Linux only, else 0)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(args):
+    """Start a WhisperServer on a free local port in a background thread and return it with the port."""
+    server = WhisperServer(None, host="127.0.0.1", port=0, workers=args.workers, max_queue=args.max_queue,
+                           preload_models=(args.model,), outputs=NullSender())
+    server.results = ResultCache(max_entries=0)
+    server.audio_store = AudioStore(max_bytes=0)
+    server.models.get(args.model).result()
+
+    threading.Thread(target=server.start_tcp_server, daemon=True).start()
+    while getattr(server, "server", None) is None or not server.server.sockets:
+        time.sleep(0.05)
+    return server, server.server.sockets[0].getsockname()[1]
+
+
+def load_clips(directory):
+    clips = []
+    for name in sorted(os.listdir(directory)):
+        if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+            with open(os.path.join(directory, name), "rb") as f:
+                clips.append((name, f.read()))
+    return clips
+
+
+def run_client(port, clips, first, args, latencies, errors):
+    connection = WhisperConnection("127.0.0.1", port)
+    try:
+        for index in range(args.requests):
+            name, data = clips[(first + index) % len(clips)]
+            started = time.perf_counter()
+            # Asking for timings makes the server keep this request's stage breakdown.
+            response = connection.request(args.command, data, model_name=args.model, emit=False,
+                                          timings=True).result()
+            elapsed = time.perf_counter() - started
+            if response.get("status") == "success":
+                latencies.append(elapsed)
+            else:
+                errors.append(f"{name}: {response.get('message')}")
+    finally:
+        connection.close()
+
+
+def run_clients(port, args, results):
+    """Run every simulated client in this process and put their latencies and errors on results."""
+    clips = load_clips(args.clips)
+    latencies = []
+    errors = []
+    threads = [
+        threading.Thread(target=run_client, args=(port, clips, index, args, latencies, errors))
+        for index in range(args.connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("clips", help="directory of audio clips to replay")
+    parser.add_argument("--connections", type=int, default=4, help="concurrent simulated clients")
+    parser.add_argument("--requests", type=int, default=20, help="requests sent by each client")
+    parser.add_argument("--command", default="transcribe", choices=["detect_language", "transcribe", "translate",
+                                                                     "analyze"])
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    clips = [name for name in sorted(os.listdir(args.clips))
+             if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS]
+    if not clips:
+        parser.error(f"no audio clips in {args.clips}")
+
+    server, port = start_server(args)
+    # The clients run in their own process, so the CPU time and memory measured here are the server's.
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    clients = context.Process(target=run_clients, args=(port, args, results), name="benchmark-clients")
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    clients.start()
+    latencies, errors = results.get()
+    wall = time.perf_counter() - started
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    clients.join()
+
+    # The server keeps a breakdown just after sending its response, so the last ones may trail the clients.
+    expected = min(len(latencies) + len(errors), server.request_timings.maxlen)
+    deadline = time.monotonic() + 5
+    while len(server.request_timings) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stages = {}
+    for timings in server.request_timings:
+        for stage, milliseconds in timings.items():
+            stages.setdefault(stage, []).append(milliseconds / 1000)
+
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    report = {
+        "revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "clips": len(clips),
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "error_samples": errors[:10],
+        "wall_seconds": wall,
+        "requests_per_second": len(latencies) / wall,
+        "latency": percentiles(latencies),
+        "stages": {stage: percentiles(values) for stage, values in stages.items()},
+        "cpu_seconds": cpu,
+        "cpu_utilisation": cpu / wall,
+        "rss_bytes": rss_bytes(),
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_bytes": usage_after.ru_maxrss * 1024,
+        "server": {"scheduler": server.scheduler.stats(), "batching": server.batcher.stats()},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Compare fp32 and int8-quantized Whisper models on CPU for latency and word error rate.
+
+Usage: python -m benchmarks.quantization SAMPLES_DIR [--models tiny base] [--threads 4]
+
+SAMPLES_DIR holds audio clips, each with a reference transcript of the same
+name and a .txt extension. Every clip is transcribed once per model and mode
+after a warm-up run, and a table of mean latency, real-time factor and WER
+is printed per model and mode.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+import whisper
+from whisper.normalizers import BasicTextNormalizer
+
+from audio import AUDIO_EXTENSIONS, SAMPLE_RATE, load_audio_bytes
+from models import model_bytes, quantize_model
+
+
+def load_samples(directory):
+    """Return (name, audio, reference) for every clip in directory that has a reference transcript."""
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(name)
+        reference_path = os.path.join(directory, stem + ".txt")
+        if extension.lower() not in AUDIO_EXTENSIONS or not os.path.exists(reference_path):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            audio = load_audio_bytes(f.read())
+        with open(reference_path) as f:
+            samples.append((name, audio, f.read()))
+    return samples
+
+
+def word_errors(reference, hypothesis):
+    """Return the word-level edit distance between two word lists."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+
+def run(model, samples, normalize):
+    """Transcribe every sample and return the mean latency, real-time factor and corpus WER."""
+    model.transcribe(samples[0][1], fp16=False, temperature=0.0)
+    latencies = []
+    audio_seconds = 0.0
+    errors = 0
+    words = 0
+    for name, audio, reference in samples:
+        started = time.perf_counter()
+        text = model.transcribe(audio, fp16=False, temperature=0.0)["text"]
+        latencies.append(time.perf_counter() - started)
+        audio_seconds += len(audio) / SAMPLE_RATE
+        reference_words = normalize(reference).split()
+        errors += word_errors(reference_words, normalize(text).split())
+        words += len(reference_words)
+    return {
+        "mean_latency_s": sum(latencies) / len(latencies),
+        "real_time_factor": sum(latencies) / audio_seconds,
+        "wer": errors / words if words else 0.0,
+        "model_mb": model_bytes(model) / 1024 ** 2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("samples", help="directory of audio clips with .txt reference transcripts")
+    parser.add_argument("--models", nargs="+", default=["tiny", "base", "small"])
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads (default: torch's choice)")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    samples = load_samples(args.samples)
+    if not samples:
+        parser.error(f"no audio clips with reference transcripts in {args.samples}")
+    normalize = BasicTextNormalizer()
+
+    results = {}
+    print(f"{'model':<8} {'mode':<5} {'latency s':>10} {'RTF':>7} {'WER':>7} {'size MB':>8}")
+    for name in args.models:
+        for mode in ("fp32", "int8"):
+            model = whisper.load_model(name, device="cpu")
+            if mode == "int8":
+                model = quantize_model(model)
+            result = run(model, samples, normalize)
+            results[f"{name}/{mode}"] = result
+            print(f"{name:<8} {mode:<5} {result['mean_latency_s']:>10.2f} {result['real_time_factor']:>7.3f} "
+                  f"{result['wer']:>7.3f} {result['model_mb']:>8.0f}")
+            del model
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"samples": len(samples), "threads": torch.get_num_threads(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
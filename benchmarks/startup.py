@@ -0,0 +1,125 @@
+"""Measure how long the server and the client take to become usable after they are started.
+
+Usage: python -m benchmarks.startup [--model tiny] [--runs 3]
+
+The server is started in a fresh process on a free local port, with ngrok,
+MongoDB and Socket.IO left out, and timed until it accepts connections and
+until a load_model request for --model returns, which includes the warm-up
+decode. For the client, a fresh process times importing the frontend module,
+and connecting through the backend registry cache is timed against the
+running server. Each figure is the median of --runs starts.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from client import WhisperConnection
+from discovery import BackendDirectory
+
+SERVER_SCRIPT = """
+import sys
+from backend import WhisperServer
+from delivery import NullSender
+WhisperServer(None, host="127.0.0.1", port=int(sys.argv[1]), preload_models=(sys.argv[2],),
+              outputs=NullSender()).start_tcp_server()
+"""
+
+CLIENT_IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import frontend
+print(time.perf_counter() - started)
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_server(model):
+    """Return the seconds until a fresh server accepts connections and until the model is ready."""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", SERVER_SCRIPT, str(port), model])
+    try:
+        while True:
+            try:
+                connection = WhisperConnection("127.0.0.1", port)
+                break
+            except ConnectionRefusedError:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Server exited with code {process.returncode}")
+                time.sleep(0.01)
+        listening = time.perf_counter() - started
+        statuses = []
+        connection.on_status = lambda notice: statuses.append(notice["status"])
+        response = connection.send_command("load_model", model_name=model)
+        ready = time.perf_counter() - started
+        connection.close()
+        if response.get("status") != "success":
+            raise RuntimeError(response.get("message"))
+        return listening, ready, port, process, statuses
+    except BaseException:
+        process.kill()
+        raise
+
+
+def time_client_connect(port):
+    """Return the seconds the client takes to connect through a registry cache naming the server."""
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "backends_cache.json")
+        with open(cache_path, "w") as f:
+            json.dump({"fetched_at": time.time(),
+                       "backends": [{"id": "local", "url": "127.0.0.1", "port": port}]}, f)
+        started = time.perf_counter()
+        connection, _ = BackendDirectory(cache_path=cache_path, refresh=False).connect(WhisperConnection)
+        elapsed = time.perf_counter() - started
+        connection.close()
+        return elapsed
+
+
+def time_client_import():
+    output = subprocess.run([sys.executable, "-c", CLIENT_IMPORT_SCRIPT], capture_output=True, text=True,
+                            check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    runs = {"server_listening_s": [], "server_ready_s": [], "client_import_s": [], "client_connect_s": []}
+    notices = set()
+    for _ in range(args.runs):
+        listening, ready, port, process, statuses = time_server(args.model)
+        try:
+            runs["server_listening_s"].append(listening)
+            runs["server_ready_s"].append(ready)
+            notices.update(statuses)
+            runs["client_connect_s"].append(time_client_connect(port))
+        finally:
+            process.kill()
+            process.wait()
+        runs["client_import_s"].append(time_client_import())
+
+    report = {"model": args.model, "runs": args.runs, "notices_seen": sorted(notices),
+              **{name: statistics.median(values) for name, values in runs.items()}}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_hash(data):
+    """Return the hex digest used to identify a piece of audio by its content."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class AudioEntry:
+    """Decoded audio plus the spectrograms computed from it so far."""
+
+    def __init__(self, handle, audio):
+        self.handle = handle
+        self.audio = audio
+        self.mels = {}
+
+    @property
+    def nbytes(self):
+        return self.audio.nbytes + sum(mel.element_size() * mel.nelement() for mel in self.mels.values())
+
+
+class AudioStore:
+    """LRU store of decoded audio keyed by content hash and bounded by a byte budget."""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, handle):
+        """Return the entry for a handle, or None if it was never stored or has been evicted."""
+        with self.lock:
+            entry = self.entries.get(handle)
+            if entry is not None:
+                self.entries.move_to_end(handle)
+            return entry
+
+    def add(self, data, decode, handle=None):
+        """Store the audio in data, decoding it with decode only if its content is new.
+
+        handle is the content hash of data, computed here unless the caller has it.
+        """
+        handle = handle or content_hash(data)
+        entry = self.get(handle)
+        if entry is not None:
+            return entry
+        return self.put(handle, decode(data))
+
+    def put(self, handle, audio):
+        """Store audio that was decoded elsewhere under handle, keeping any entry already there."""
+        entry = AudioEntry(handle, audio)
+        with self.lock:
+            if handle not in self.entries:
+                self.entries[handle] = entry
+                self.total_bytes += entry.nbytes
+                self.evict()
+            return self.entries.get(handle, entry)
+
+    def get_mel(self, entry, key, compute):
+        """Return the spectrogram cached under key for an entry, computing it on first use."""
+        mel = entry.mels.get(key)
+        if mel is not None:
+            return mel
+
+        mel = compute(entry.audio)
+        with self.lock:
+            before = entry.nbytes
+            entry.mels[key] = mel
+            if self.entries.get(entry.handle) is entry:
+                self.total_bytes += entry.nbytes - before
+                self.evict(keep=entry.handle)
+        return mel
+
+    def evict(self, keep=None):
+        """Drop least recently used entries until the store fits its byte budget.
+
+        The newest entry is kept even when it alone is over budget, unless the
+        budget is 0, which keeps nothing.
+        """
+        while self.total_bytes > self.max_bytes and len(self.entries) > (1 if self.max_bytes else 0):
+            handle = next(iter(self.entries))
+            if handle == keep:
+                self.entries.move_to_end(handle)
+                handle = next(iter(self.entries))
+            self.total_bytes -= self.entries.pop(handle).nbytes
+
+
+class ResultCache:
+    """LRU cache of command results, optionally backed by a sqlite file so results survive restarts.
+
+    Results are JSON-serialisable dicts. The in-memory LRU holds up to
+    max_entries of them; the file keeps the max_disk_entries most recently used.
+    """
+
+    def __init__(self, max_entries=1024, path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            self.db.commit()
+
+    def get(self, key):
+        """Return the result stored under key, or None on a miss."""
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+            elif self.db is not None:
+                row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row:
+                    result = json.loads(row[0])
+                    self.remember(key, result)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.db is not None:
+                self.db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.remember(key, result)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, json.dumps(result), time.time()))
+                self.db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+                self.db.commit()
+
+    def remember(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+            }
+            if self.db is not None:
+                stats["disk_entries"] = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            return stats
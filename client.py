@@ -0,0 +1,154 @@
+import itertools
+import socket
+import threading
+from concurrent.futures import Future
+
+from protocol import HEADER, NOTICE, REQUEST, pack_frame, read_message, unpack_header
+
+
+class WhisperConnection:
+    """Connection to a WhisperServer that can keep several requests in flight at once.
+
+    Every message carries a request id; a background thread reads responses as
+    they arrive, in any order, and resolves the future of the matching request.
+    Interim "queued", "loading" and "warming" notices are passed to on_status
+    instead, and partial results of live streams or streamed transcripts to
+    the listener registered for them.
+    """
+
+    def __init__(self, hostname, port, on_status=None):
+        self.sock = socket.create_connection((hostname, port))
+        self.on_status = on_status
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.listeners = {}
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.buffer = bytearray(64 * 1024)
+        self.reader = threading.Thread(target=self.read_responses, daemon=True)
+        self.reader.start()
+
+    def send_frame(self, message, payload=None):
+        """Send a request frame, its raw payload following the control body."""
+        try:
+            self.sock.sendall(pack_frame(REQUEST, message, payload))
+            if payload is not None:
+                self.sock.sendall(payload)
+        except Exception as e:
+            print(f"Error in send_frame: {e}")
+            raise
+
+    def receive_exact(self, size):
+        """Read exactly size bytes into the reusable receive buffer and return a view of them."""
+        if len(self.buffer) < size:
+            self.buffer = bytearray(max(size, 2 * len(self.buffer)))
+        view = memoryview(self.buffer)[:size]
+        received = 0
+        while received < size:
+            count = self.sock.recv_into(view[received:], size - received)
+            if not count:
+                return None
+            received += count
+        return view
+
+    def receive_frame(self):
+        """Receive one frame and return its type and message, or None once the connection closes."""
+        try:
+            header = self.receive_exact(HEADER.size)
+            if header is None:
+                return None
+            kind, codec, request_id, body_size, payload_size = unpack_header(header)
+            body = self.receive_exact(body_size)
+            if body is None:
+                return None
+            message = read_message(codec, request_id, body)
+            # Responses carry no payload today; skip any so the stream stays in sync.
+            if payload_size and self.receive_exact(payload_size) is None:
+                return None
+            return kind, message
+        except Exception as e:
+            print(f"Error during data transfer: {e}")
+            return None
+
+    def request(self, command, audio=None, on_partial=None, **kwargs):
+        """Send a command without waiting and return a future for its response.
+
+        With on_partial, the request asks for its transcript as it is decoded
+        and on_partial is called with every piece of text that arrives.
+        """
+        request_id = next(self.request_ids)
+        message = {"command": command, "request_id": request_id, **kwargs}
+        if on_partial:
+            message["stream_tokens"] = True
+
+        future = Future()
+        with self.lock:
+            self.pending[request_id] = future
+            if on_partial:
+                self.listeners[request_id] = lambda notice: on_partial(notice["text"])
+        try:
+            # The frame header, body and audio must reach the socket back to back.
+            with self.send_lock:
+                self.send_frame(message, audio)
+        except Exception as e:
+            with self.lock:
+                self.pending.pop(request_id, None)
+                self.listeners.pop(request_id, None)
+            future.set_exception(e)
+        return future
+
+    def notify(self, command, audio=None, **kwargs):
+        """Send a command that gets no response, such as a chunk of live stream audio."""
+        with self.send_lock:
+            self.send_frame({"command": command, **kwargs}, audio)
+
+    def listen(self, stream_id, callback):
+        """Call callback with every partial result pushed for a live stream."""
+        with self.lock:
+            self.listeners[stream_id] = callback
+
+    def unlisten(self, stream_id):
+        with self.lock:
+            self.listeners.pop(stream_id, None)
+
+    def send_command(self, command, audio=None, **kwargs):
+        """Send a command and block until its response arrives."""
+        return self.request(command, audio, **kwargs).result()
+
+    def read_responses(self):
+        while True:
+            frame = self.receive_frame()
+            if frame is None:
+                break
+
+            kind, response = frame
+            request_id = response.get("request_id")
+            if kind == NOTICE and response.get("status") in ("queued", "loading", "warming"):
+                if self.on_status:
+                    self.on_status(response)
+                continue
+            if kind == NOTICE:
+                # Live streams are listened to by stream id, streamed transcripts by request id.
+                with self.lock:
+                    listener = self.listeners.get(response.get("stream_id", request_id))
+                if listener:
+                    listener(response)
+                continue
+
+            with self.lock:
+                future = self.pending.pop(request_id, None)
+                self.listeners.pop(request_id, None)
+            if future:
+                future.set_result(response)
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError("Connection to server closed"))
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
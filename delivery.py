@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import deque
+
+import socketio
+
+
+class OutputSender:
+    """Delivers Socket.IO events from a background thread so emitting never holds up inference.
+
+    Events wait in a bounded buffer, dropping the oldest once it is full. The
+    sender takes up to max_batch of them off the buffer at a time and emits
+    them one by one, since Socket.IO listeners expect one payload per event.
+    While the Socket.IO server is unreachable the sender reconnects with
+    exponential backoff and retries each event up to max_attempts times.
+    """
+
+    def __init__(self, url, max_pending=1000, max_batch=32, max_attempts=5, max_backoff=30.0):
+        self.url = url
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        # Reconnecting is left to the sender thread, which knows when events are waiting.
+        self.sio = socketio.Client(reconnection=False)
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.reconnects = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.thread = threading.Thread(target=self.worker, name="output-sender", daemon=True)
+        self.thread.start()
+
+    def send(self, event, data):
+        """Queue an event for delivery and return at once."""
+        with self.condition:
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append((event, data, time.monotonic(), 0))
+            self.condition.notify()
+
+    def connect(self):
+        """Block until connected to the Socket.IO server, backing off between attempts."""
+        backoff = 0.5
+        while not self.sio.connected:
+            try:
+                self.sio.connect(self.url)
+                print(f"Connected to Socket.IO server at {self.url}")
+            except Exception as e:
+                print(f"Error connecting to Socket.IO server, retrying in {backoff:.1f}s: {e}")
+                with self.condition:
+                    self.reconnects += 1
+                time.sleep(backoff)
+                backoff = min(2 * backoff, self.max_backoff)
+
+    def next_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            return [self.pending.popleft() for _ in range(min(len(self.pending), self.max_batch))]
+
+    def worker(self):
+        self.connect()
+        while True:
+            batch = self.next_batch()
+            self.connect()
+            for index, (event, data, queued_at, attempts) in enumerate(batch):
+                try:
+                    self.sio.emit(event, data)
+                except Exception as e:
+                    print(f"Error sending event '{event}' to Socket.IO server: {e}")
+                    self.requeue(batch[index:])
+                    try:
+                        self.sio.disconnect()
+                    except Exception:
+                        pass
+                    break
+                latency = time.monotonic() - queued_at
+                with self.condition:
+                    self.sent += 1
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+
+    def requeue(self, events):
+        """Put undelivered events back at the front of the buffer, giving up on those out of attempts."""
+        with self.condition:
+            for event, data, queued_at, attempts in reversed(events):
+                if attempts + 1 >= self.max_attempts:
+                    self.failed += 1
+                    continue
+                self.retried += 1
+                self.pending.appendleft((event, data, queued_at, attempts + 1))
+
+    def stats(self):
+        """Return delivery counts, buffer depth and queue-to-emit latency."""
+        with self.condition:
+            return {
+                "connected": self.sio.connected,
+                "pending_events": len(self.pending),
+                "max_pending": self.max_pending,
+                "sent_events": self.sent,
+                "failed_events": self.failed,
+                "dropped_events": self.dropped,
+                "retried_events": self.retried,
+                "reconnects": self.reconnects,
+                "avg_delivery_ms": 1000 * self.total_latency / self.sent if self.sent else 0.0,
+                "max_delivery_ms": 1000 * self.max_latency,
+            }
+
+
+class NullSender:
+    """Stands in for OutputSender where nothing should be delivered, counting the events it drops."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, event, data):
+        self.sent += 1
+
+    def stats(self):
+        return {"sent_events": self.sent}
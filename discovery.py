@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import time
+
+# How often a backend refreshes its registry entry, and how long the entry lives without a refresh.
+HEARTBEAT_SECONDS = 10
+TTL_SECONDS = 30
+
+
+class MongoBackendStore:
+    """Backend registry kept in MongoDB, one document per backend keyed by its id.
+
+    Servers that predate the registry only write the single document of the
+    legacy "ngrok" collection; it is returned when no backend has registered.
+    """
+
+    def __init__(self, uri, database="PROJECT", collection="backends"):
+        # Imported here so clients starting from the cached registry never load the driver.
+        from pymongo import MongoClient
+
+        self.db = MongoClient(uri)[database]
+        self.collection = self.db[collection]
+
+    def upsert(self, backend):
+        self.collection.replace_one({"_id": backend["id"]}, {"_id": backend["id"], **backend}, upsert=True)
+
+    def remove(self, backend_id):
+        self.collection.delete_one({"_id": backend_id})
+
+    def alive(self):
+        backends = [
+            {key: value for key, value in backend.items() if key != "_id"}
+            for backend in self.collection.find({"expires_at": {"$gt": time.time()}})
+        ]
+        if not backends:
+            legacy = self.db["ngrok"].find_one()
+            if legacy:
+                backends = [{"id": "legacy", "url": legacy["url"], "port": legacy["port"]}]
+        return backends
+
+
+class FileBackendStore:
+    """Backend registry kept in a local JSON file, standing in for MongoDB in tests and on one machine."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, backends):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(backends, f)
+        os.replace(temp_path, self.path)
+
+    def upsert(self, backend):
+        with self.lock:
+            backends = self.read()
+            backends[backend["id"]] = backend
+            self.write(backends)
+
+    def remove(self, backend_id):
+        with self.lock:
+            backends = self.read()
+            backends.pop(backend_id, None)
+            self.write(backends)
+
+    def alive(self):
+        now = time.time()
+        return [backend for backend in self.read().values() if backend.get("expires_at", 0) > now]
+
+
+def open_store():
+    """Return the registry named by BACKEND_REGISTRY_FILE, or the MongoDB one at MONGO_URI."""
+    path = os.getenv("BACKEND_REGISTRY_FILE")
+    if path:
+        return FileBackendStore(path)
+    return MongoBackendStore(os.getenv("MONGO_URI"))
+
+
+def backend_load(backend):
+    """Return the jobs running or queued on a backend per worker; unknown load sorts last."""
+    if "capacity" not in backend:
+        return float("inf")
+    return (backend.get("active_jobs", 0) + backend.get("queue_depth", 0)) / max(1, backend["capacity"])
+
+
+class BackendDirectory:
+    """Client view of the backend registry, cached on disk so startup does not wait on the store.
+
+    connect tries backends from least to most loaded and moves on when one
+    refuses the connection; if every cached backend fails, the registry is
+    read again before giving up. The cache is used however old it is unless
+    max_age is given; after connecting from it, the registry is read again
+    in the background so the next start sees current backends and load.
+    """
+
+    def __init__(self, store_factory=open_store, cache_path="backends_cache.json", max_age=None, refresh=True):
+        self.store_factory = store_factory
+        self.store = None
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.refresh = refresh
+        self.lock = threading.Lock()
+
+    def fetch(self):
+        with self.lock:
+            if self.store is None:
+                self.store = self.store_factory()
+            backends = self.store.alive()
+            try:
+                with open(self.cache_path, "w") as f:
+                    json.dump({"fetched_at": time.time(), "backends": backends}, f)
+            except OSError as e:
+                print(f"Error caching backend registry: {e}")
+        return backends
+
+    def fetch_in_background(self):
+        def run():
+            try:
+                self.fetch()
+            except Exception as e:
+                print(f"Error refreshing backend registry: {e}")
+
+        threading.Thread(target=run, name="backend-registry-refresh", daemon=True).start()
+
+    def cached(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.max_age is not None and time.time() - cache["fetched_at"] > self.max_age:
+            return None
+        return cache["backends"]
+
+    def connect(self, factory, exclude=()):
+        """Return factory(hostname, port) for the least loaded backend that accepts the connection."""
+        backends = self.cached()
+        from_cache = backends is not None
+        if not from_cache:
+            backends = self.fetch()
+
+        while True:
+            for backend in sorted(backends, key=backend_load):
+                if backend["id"] in exclude:
+                    continue
+                try:
+                    connection = factory(backend["url"], backend["port"])
+                except OSError as e:
+                    print(f"Could not connect to backend {backend['url']}:{backend['port']}: {e}")
+                    continue
+                print(f"Connected to backend {backend['url']}:{backend['port']}")
+                if from_cache and self.refresh:
+                    self.fetch_in_background()
+                return connection, backend
+            if not from_cache:
+                raise ConnectionError("No inference backend is reachable")
+            backends = self.fetch()
+            from_cache = False
+
+
+class BackendAnnouncer:
+    """Keeps a server's registry entry alive with its address, capacity and current load."""
+
+    def __init__(self, store, backend_id, describe):
+        self.store = store
+        self.backend_id = backend_id
+        self.describe = describe
+        self.thread = threading.Thread(target=self.run, name="backend-heartbeat", daemon=True)
+
+    def announce(self):
+        self.store.upsert({"id": self.backend_id, **self.describe(), "expires_at": time.time() + TTL_SECONDS})
+
+    def start(self):
+        self.announce()
+        self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            try:
+                self.announce()
+            except Exception as e:
+                print(f"Error refreshing backend registration: {e}")
+
+    def stop(self):
+        self.store.remove(self.backend_id)
@@ -8,98 +8,158 @@ import sounddevice as sd
 import numpy as np
 import wavio
 import os
-import socket
-import json
 import base64
-import struct
-from threading import Thread, Event
-from pymongo import MongoClient
+import queue
+import shutil
+import time
+from threading import Thread, Event, Lock
 from dotenv import load_dotenv
 
+from audio import STREAM_CODECS, encode_stream, trim_silence
+from client import WhisperConnection
+from discovery import BackendDirectory
+
 load_dotenv()
 
 json_reg = re.compile(r"{.*}")
 
 
+class RecordingBuffer:
+    """Preallocated int16 sample buffer that grows by doubling, up to a fixed number of samples."""
+
+    def __init__(self, max_samples, initial_samples=16000 * 30):
+        self.max_samples = max_samples
+        self.samples = np.empty(min(initial_samples, max_samples), np.int16)
+        self.length = 0
+
+    @property
+    def full(self):
+        return self.length >= self.max_samples
+
+    def write(self, frames):
+        """Append frames, dropping what does not fit, and return False once the cap is reached."""
+        count = min(len(frames), self.max_samples - self.length)
+        end = self.length + count
+        if end > len(self.samples):
+            grown = np.empty(min(self.max_samples, max(2 * len(self.samples), end)), np.int16)
+            grown[:self.length] = self.samples[:self.length]
+            self.samples = grown
+        self.samples[self.length:end] = frames[:count]
+        self.length = end
+        return not self.full
+
+    def data(self):
+        return self.samples[:self.length]
+
+
+class TranscriptPrefetch:
+    """Transcript text streamed while a new recording is analyzed, passed on live once it is asked for."""
+
+    def __init__(self, audio_path):
+        self.audio_path = audio_path
+        self.pieces = []
+        self.on_text = None
+        self.lock = Lock()
+        self.done = Event()
+
+    def add(self, text):
+        with self.lock:
+            self.pieces.append(text)
+            if self.on_text:
+                self.on_text(text)
+
+    def follow(self, on_text):
+        """Pass on the text so far and every piece streamed after it, returning once the analysis is done."""
+        with self.lock:
+            if self.pieces:
+                on_text("".join(self.pieces))
+            self.on_text = on_text
+        self.done.wait()
+
+
 class WhisperClient:
     def __init__(self):
+        self.started = time.monotonic()
         self.root = tk.Tk()
         self.chunk_size = 8192
         self.setup_gui()
         self.recording_event = Event()
         self.audio_path = None
-        self.setup_socket()
+        self.audio_handle = None
+        self.prefetch = None
+        self.model_name = None
+        self.connection = None
+        self.connected = Event()
+        self.backend = None
+        self.backends = BackendDirectory()
+        # Codecs to upload recordings in, most preferred first; an empty list keeps plain WAV uploads.
+        self.upload_codecs = list(STREAM_CODECS) if shutil.which("ffmpeg") else []
+        self.upload_codec = None
+        # Connect in the background so the window appears at once; commands wait for the connection.
+        self.status_label.config(text="Connecting to server...")
+        Thread(target=self.setup_socket, daemon=True).start()
+        self.root.after(0, self.report_window_shown)
         self.sent = False
         self.mode = "document"
+        self.inline_audio = True
+        self.max_recording_seconds = 600
+        # Cut silence out of recordings before upload; this needs the whole clip, so it skips compressed uploads.
+        self.trim_recordings = False
 
-    def send_chunked(self, data):
-        try:
-            send_json_data = json.dumps(data).encode()
-            print(f"Encoded data size with padding: {len(send_json_data)}")
-
-            size = len(send_json_data)
-            self.sock.sendall(struct.pack('!I', size))
-            self.sock.sendall(send_json_data)  # Send all at once for efficiency
-
-        except Exception as e:
-            print(f"Error in send_chunked: {e}")
-            raise
-
-    def receive_chunked(self):
-        try:
-            size_data = self.sock.recv(4)
-            if not size_data:
-                return None
-            total_size = struct.unpack('!I', size_data)[0]
-            data = self.sock.recv(total_size)  # Receive all at once
-            if not data:
-                return None
-
-            received_data = json.loads(data.decode())
-            return received_data
-
-        except Exception as e:
-            print(f"Error during data transfer: {e}")
-            return None
+    def report_window_shown(self):
+        print(f"Window shown {time.monotonic() - self.started:.2f}s after startup")
 
-    def get_ngrok_details(self):
+    def setup_socket(self):
+        # Pick the least loaded backend from the registry, skipping any that refuse the connection
         try:
-            # Connect to MongoDB and retrieve the Ngrok details
-            mongo_client = MongoClient(os.getenv("MONGO_URI"))
-            db = mongo_client["PROJECT"]
-            ngrok_collection = db["ngrok"]
-
-            ngrok_details = ngrok_collection.find_one()
-            print(f"Ngrok details: {ngrok_details}")
-            if ngrok_details:
-                return ngrok_details["url"], ngrok_details["port"]
-            else:
-                raise Exception("No Ngrok details found in MongoDB.")
+            self.connection, self.backend = self.backends.connect(self.open_connection)
         except Exception as e:
-            messagebox.showerror("Error", f"Error fetching Ngrok details: {e}")
-            return None, None
-
-    def setup_socket(self):
-        # Get the Ngrok URL and port dynamically from MongoDB
-        hostname, port = self.get_ngrok_details()
-        if not hostname or not port:
-            self.root.quit()
+            self.root.after(0, self.connection_failed, e)
+            return
+        self.connected.set()
+        print(f"Connected {time.monotonic() - self.started:.2f}s after startup")
+        self.root.after(0, self.status_label.config, {"text": "Connected to server."})
+        self.negotiate_codec()
+
+    def connection_failed(self, error):
+        messagebox.showerror("Error", f"Could not connect to server. Please ensure the server is running: {error}")
+        self.root.quit()
+
+    def open_connection(self, hostname, port):
+        return WhisperConnection(hostname, port, on_status=self.show_queue_status)
+
+    def fail_over(self):
+        """Replace a dropped connection with one to another backend; audio handles do not carry over."""
+        failed = self.backend["id"]
+        self.connection.close()
+        self.connection, self.backend = self.backends.connect(self.open_connection, exclude=(failed,))
+        self.audio_handle = None
+        self.upload_codec = None
+        self.negotiate_codec()
+
+    def negotiate_codec(self):
+        """Agrees on a compressed upload codec with the server, keeping WAV uploads if there is none."""
+        if not self.upload_codecs:
             return
+        response = self.send_command("negotiate", codecs=self.upload_codecs)
+        # Servers that predate negotiation answer with an error and get WAV uploads.
+        if response.get("status") == "success":
+            self.upload_codec = response.get("codec")
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            self.sock.connect((hostname, port))
-        except ConnectionRefusedError:
-            messagebox.showerror("Error", "Could not connect to server. Please ensure the server is running.")
-            self.root.quit()
+    def show_queue_status(self, response):
+        self.status_label.config(text=response.get("message", "Waiting for server..."))
 
-    def send_command(self, command, **kwargs):
+    def send_command(self, command, audio=None, **kwargs):
         mode = self.mode_var.get()
-        message = {"command": command, "mode": mode, **kwargs}
-        # print(f"Sending command: {message}")
+        if not self.connected.wait(timeout=30):
+            return {"status": "error", "message": "Not connected to server"}
         try:
-            self.send_chunked(message)
-            response = self.receive_chunked()
+            try:
+                response = self.connection.send_command(command, audio, mode=mode, **kwargs)
+            except OSError as e:
+                print(f"Lost connection to backend {self.backend['id']}, failing over: {e}")
+                self.fail_over()
+                response = self.connection.send_command(command, audio, mode=mode, **kwargs)
             print(f"Received response: {response}")
             if mode in ["transcribe", "translate"]:
                 self.sent = True
@@ -156,6 +216,10 @@ class WhisperClient:
         self.record_button = ttk.Button(button_frame1, text="🎙️ Record Audio", command=self.toggle_recording)
         self.record_button.pack(side="left", padx=5)
 
+        self.live_var = tk.BooleanVar(value=False)
+        live_switch = ttk.Checkbutton(button_frame1, text="Live", variable=self.live_var)
+        live_switch.pack(side="left", padx=5)
+
         open_button = ttk.Button(button_frame1, text="📂 Open Audio File", command=self.open_audio_file)
         open_button.pack(side="left", padx=5)
 
@@ -182,6 +246,7 @@ class WhisperClient:
         transcript_label = ttk.Label(self.transcript_frame, text="Transcription:")
         transcript_label.pack(anchor="w")
         self.transcript_text = tk.Text(self.transcript_frame, wrap="word", font=("Arial", 10), height=10, width=50)
+        self.transcript_text.tag_configure("tentative", foreground="#888888")
         self.transcript_text.pack(padx=5, pady=5)
 
         self.translation_frame = ttk.Frame(self.root)
@@ -202,6 +267,7 @@ class WhisperClient:
         try:
             response = self.send_command("load_model", model_name=selected)
             if response["status"] == "success":
+                self.model_name = selected
                 self.status_label.config(text=response["message"])
             else:
                 self.status_label.config(text=f"Error: {response['message']}")
@@ -226,18 +292,62 @@ class WhisperClient:
             print(f"Error uploading file: {e}")
             return None
 
-    def detect_language(self, audio_file):
-        """Detects language from the audio file by uploading it and sending the link."""
-        try:
-            with open(audio_file, 'rb') as f:
-                base64_audio = base64.b64encode(f.read()).decode()
+    def audio_arguments(self, audio_file):
+        """Returns the send_command arguments carrying the audio, inline unless disabled."""
+        with open(audio_file, 'rb') as f:
+            audio_data = f.read()
+
+        if self.inline_audio:
+            return {"audio": audio_data}
+
+        upload_url = self.upload_file(base64.b64encode(audio_data).decode(), os.path.basename(audio_file))
+        if not upload_url:
+            return None
+        return {"audio_url": upload_url}
+
+    def set_audio_path(self, audio_file, audio_handle=None):
+        """Selects a new audio file and forgets the server handle of the previous one."""
+        self.audio_path = audio_file
+        self.audio_handle = audio_handle
+
+    def send_audio_command(self, command, **kwargs):
+        """Sends a command for the current audio, uploading it only if the server lacks it."""
+        model_args = {"model_name": self.model_name, **kwargs} if self.model_name else kwargs
+        if self.audio_handle:
+            response = self.send_command(command, audio_handle=self.audio_handle, **model_args)
+            if response and response.get("code") != "unknown_audio_handle":
+                return response
+
+        audio_args = self.audio_arguments(self.audio_path)
+        if not audio_args:
+            return None
 
-            upload_url = self.upload_file(base64_audio, os.path.basename(audio_file))
-            if not upload_url:
+        response = self.send_command(command, **audio_args, **model_args)
+        if response and response.get("audio_handle"):
+            self.audio_handle = response["audio_handle"]
+        return response
+
+    def detect_language(self, audio_file, audio_handle=None):
+        """Detects language from the audio file, sending it inline or as an uploaded link.
+
+        The transcript is computed in the same encoder pass and kept by the
+        server, so the Transcribe button answers at once, or follows the
+        transcript as it streams in while the analysis is still running;
+        translations are only decoded when asked for.
+        """
+        prefetch = self.prefetch = TranscriptPrefetch(audio_file)
+        try:
+            self.set_audio_path(audio_file, audio_handle)
+            response = self.send_audio_command("analyze", outputs=["detect_language", "transcribe"], emit=False,
+                                               on_partial=prefetch.add)
+            if response and response.get("message") == "Unknown command":
+                response = self.send_audio_command("detect_language")
+            elif response and response["status"] == "success":
+                response = response["results"]["detect_language"]
+            if not response:
                 self.status_label.config(text="Error uploading audio file for language detection.")
                 return
 
-            response = self.send_command("detect_language", audio_url=upload_url)
             if response["status"] == "success":
                 self.language_label.config(text=f"Detected Language: {response['language']}")
                 self.status_label.config(text=f"Loaded file: {os.path.basename(audio_file)}")
@@ -245,42 +355,166 @@ class WhisperClient:
                 self.status_label.config(text=f"Error: {response['message']}")
         except Exception as e:
             self.status_label.config(text=f"Error during language detection: {e}")
+        finally:
+            prefetch.done.set()
+
+    def start_upload(self):
+        """Starts a compressed upload that recorded audio is encoded into as it is captured."""
+        response = self.send_command("upload_start", codec=self.upload_codec)
+        if response["status"] != "success":
+            print(f"Falling back to WAV upload: {response['message']}")
+            return None
+
+        upload_id = response["upload_id"]
+        sent = []
+
+        def send(chunk):
+            sent.append(len(chunk))
+            self.connection.notify("upload_chunk", chunk, upload_id=upload_id)
+
+        return upload_id, encode_stream(self.upload_codec, send), sent
+
+    def finish_upload(self, upload):
+        """Flushes a compressed upload and returns the server handle of its audio, or None if it failed."""
+        upload_id, encoder, sent = upload
+        stopped = time.monotonic()
+        try:
+            encoder.finish()
+        except Exception as e:
+            print(f"Error encoding {self.upload_codec} upload: {e}")
+            encoder.kill()
+        response = self.send_command("upload_end", upload_id=upload_id)
+        if response["status"] != "success":
+            print(f"Error finishing {self.upload_codec} upload: {response['message']}")
+            return None
+        print(f"Uploaded {sum(sent)} bytes of {self.upload_codec} for {response['duration']:.1f}s of audio, "
+              f"ready {1000 * (time.monotonic() - stopped):.0f} ms after recording stopped")
+        return response["audio_handle"]
 
     def start_recording(self):
-        fs = 44100
+        fs = 16000
 
         def record():
             try:
                 self.status_label.config(text="Recording... Press Stop to finish.")
+                upload = self.start_upload() if self.upload_codec and not self.trim_recordings else None
+                encoder = upload[1] if upload else None
                 self.recording_event.set()
-                buffer = []
+                buffer = RecordingBuffer(fs * self.max_recording_seconds, initial_samples=fs * 30)
 
                 def callback(indata, frames, time, status):
-                    if self.recording_event.is_set():
-                        buffer.append(indata.copy())
-                    else:
+                    if not self.recording_event.is_set():
+                        raise sd.CallbackStop
+                    if encoder:
+                        encoder.feed(indata)
+                    if not buffer.write(indata[:, 0]):
+                        self.recording_event.clear()
                         raise sd.CallbackStop
 
-                with sd.InputStream(samplerate=fs, channels=1, callback=callback):
+                with sd.InputStream(samplerate=fs, channels=1, dtype="int16", callback=callback):
                     while self.recording_event.is_set():
                         sd.sleep(100)
 
-                recording = np.concatenate(buffer, axis=0)
+                if buffer.full:
+                    self.record_button.config(text="🎙️ Record Audio")
                 save_path = os.path.join("recordings", "recording.wav")
                 os.makedirs("recordings", exist_ok=True)
+                recording = trim_silence(buffer.data(), fs) if self.trim_recordings else buffer.data()
                 wavio.write(save_path, recording, fs, sampwidth=2)
-                self.audio_path = save_path
-                self.status_label.config(text="Audio recorded successfully!")
-                self.detect_language(self.audio_path)
+                # The WAV stays on disk so the audio can be re-sent if the server drops the upload.
+                audio_handle = self.finish_upload(upload) if upload else None
+                if buffer.full:
+                    self.status_label.config(text=f"Recording stopped at the {self.max_recording_seconds}s limit.")
+                else:
+                    self.status_label.config(text="Audio recorded successfully!")
+                self.detect_language(save_path, audio_handle)
             except Exception as e:
                 self.status_label.config(text=f"Error during recording: {e}")
 
         self.recording_thread = Thread(target=record, daemon=True)
         self.recording_thread.start()
 
+    def append_text(self, widget):
+        """Returns an on_partial callback that appends streamed text to a Text widget from the Tk event loop."""
+        return lambda text: self.root.after(0, widget.insert, tk.END, text)
+
+    def show_text(self, widget, text):
+        widget.delete("1.0", tk.END)
+        widget.insert(tk.END, text)
+
+    def show_partial(self, response):
+        """Shows the committed text of a live stream, followed by its still tentative tail."""
+        self.transcript_text.delete("1.0", tk.END)
+        self.transcript_text.insert(tk.END, response["committed"])
+        if response["committed"] and response["tentative"]:
+            self.transcript_text.insert(tk.END, " ")
+        self.transcript_text.insert(tk.END, response["tentative"], "tentative")
+
+    def start_live_recording(self):
+        """Streams 16 kHz PCM to the server while recording and shows partial transcripts as they arrive."""
+        fs = 16000
+
+        def record():
+            stream_id = None
+            try:
+                model_args = {"model_name": self.model_name} if self.model_name else {}
+                response = self.send_command("stream_start", **model_args)
+                if response["status"] != "success":
+                    self.status_label.config(text=f"Error: {response['message']}")
+                    return
+
+                stream_id = response["stream_id"]
+                self.connection.listen(stream_id, self.show_partial)
+                self.transcript_text.delete("1.0", tk.END)
+                self.translation_frame.pack_forget()
+                self.transcript_frame.pack(pady=(5, 10))
+                self.status_label.config(text="Live transcription... Press Stop to finish.")
+                self.recording_event.set()
+                frames = queue.Queue()
+
+                def callback(indata, frame_count, time, status):
+                    # Sending happens on the recording thread so the audio callback never blocks on the socket.
+                    if self.recording_event.is_set():
+                        frames.put(bytes(indata))
+                    else:
+                        raise sd.CallbackStop
+
+                with sd.InputStream(samplerate=fs, channels=1, dtype="int16", blocksize=fs // 10,
+                                    callback=callback):
+                    while self.recording_event.is_set():
+                        try:
+                            chunk = frames.get(timeout=0.1)
+                        except queue.Empty:
+                            continue
+                        self.connection.notify("stream_audio", chunk, stream_id=stream_id)
+                while not frames.empty():
+                    self.connection.notify("stream_audio", frames.get(), stream_id=stream_id)
+
+                response = self.send_command("stream_end", stream_id=stream_id)
+                if response["status"] == "success":
+                    self.transcript_text.delete("1.0", tk.END)
+                    self.transcript_text.insert(tk.END, response["text"])
+                    self.status_label.config(text=f"Live transcription completed in {self.mode} mode.")
+                    self.clear_button.pack(pady=(10, 20))
+                else:
+                    self.status_label.config(text=f"Error: {response['message']}")
+            except Exception as e:
+                self.recording_event.clear()
+                self.record_button.config(text="🎙️ Record Audio")
+                self.status_label.config(text=f"Error during live transcription: {e}")
+            finally:
+                if stream_id:
+                    self.connection.unlisten(stream_id)
+
+        self.recording_thread = Thread(target=record, daemon=True)
+        self.recording_thread.start()
+
     def toggle_recording(self):
         if self.recording_event.is_set():
             self.stop_recording()
+        elif self.live_var.get():
+            self.start_live_recording()
+            self.record_button.config(text="⏹️ Stop Recording")
         else:
             self.start_recording()
             self.record_button.config(text="⏹️ Stop Recording")
@@ -293,8 +527,8 @@ class WhisperClient:
     def open_audio_file(self):
         file = filedialog.askopenfilename(filetypes=[("Audio Files", "*.mp3 *.wav *.m4a")])
         if file:
-            self.audio_path = file
-            self.detect_language(self.audio_path)
+            # The analysis also decodes the transcript, so it runs off the Tk event loop.
+            Thread(target=self.detect_language, args=(file,), daemon=True).start()
 
     def transcribe_audio(self):
         Thread(target=self._transcribe_audio_thread).start()
@@ -310,20 +544,21 @@ class WhisperClient:
                 messagebox.showwarning("Warning", "Please record or open an audio file first.")
                 return
 
-            with open(self.audio_path, 'rb') as f:
-                base64_audio = base64.b64encode(f.read()).decode()
-
-            upload_url = self.upload_file(base64_audio, os.path.basename(self.audio_path))
-            if not upload_url:
+            self.transcript_text.delete("1.0", tk.END)
+            self.translation_frame.pack_forget()
+            self.transcript_frame.pack(pady=(5, 10))
+            prefetch = self.prefetch
+            if prefetch is not None and prefetch.audio_path == self.audio_path and not prefetch.done.is_set():
+                # Show the transcript the analysis is decoding rather than decoding it a second time.
+                prefetch.follow(self.append_text(self.transcript_text))
+            response = self.send_audio_command("transcribe", on_partial=self.append_text(self.transcript_text))
+            if not response:
                 self.status_label.config(text="Error uploading audio file for transcription.")
                 return
 
-            response = self.send_command("transcribe", audio_url=upload_url)
             if response["status"] == "success":
-                self.transcript_text.delete("1.0", tk.END)
-                self.transcript_text.insert(tk.END, response["text"])
-                self.translation_frame.pack_forget()
-                self.transcript_frame.pack(pady=(5, 10))
+                # Queued behind the streamed pieces, so the complete text replaces them rather than racing them.
+                self.root.after(0, self.show_text, self.transcript_text, response["text"])
                 self.status_label.config(text=f"Transcription completed in {self.mode} mode.")
                 self.clear_button.pack(pady=(10, 20))
             else:
@@ -341,20 +576,17 @@ class WhisperClient:
                 messagebox.showwarning("Warning", "Please record or open an audio file first.")
                 return
 
-            with open(self.audio_path, 'rb') as f:
-                base64_audio = base64.b64encode(f.read()).decode()
-
-            upload_url = self.upload_file(base64_audio, os.path.basename(self.audio_path))
-            if not upload_url:
+            self.translation_text.delete("1.0", tk.END)
+            self.transcript_frame.pack_forget()
+            self.translation_frame.pack(pady=(5, 10))
+            response = self.send_audio_command("translate", on_partial=self.append_text(self.translation_text))
+            if not response:
                 self.status_label.config(text="Error uploading audio file for translation.")
                 return
 
-            response = self.send_command("translate", audio_url=upload_url)
             if response["status"] == "success":
-                self.translation_text.delete("1.0", tk.END)
-                self.translation_text.insert(tk.END, response["text"])
-                self.transcript_frame.pack_forget()
-                self.translation_frame.pack(pady=(5, 10))
+                # Queued behind the streamed pieces, so the complete text replaces them rather than racing them.
+                self.root.after(0, self.show_text, self.translation_text, response["text"])
                 self.status_label.config(text=f"Translation completed in {self.mode} mode.")
                 self.clear_button.pack(pady=(10, 20))
             else:
@@ -375,7 +607,8 @@ class WhisperClient:
         try:
             self.root.mainloop()
         finally:
-            self.sock.close()
+            if self.connection:
+                self.connection.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,17 @@
+import importlib
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    Modules that reach torch and whisper only from code paths that run after
+    startup can hold one of these at module level instead of paying for the
+    import before the server starts listening.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        # Only called for names not set in __init__; after the first import this is a sys.modules lookup.
+        return getattr(importlib.import_module(self.name), attr)
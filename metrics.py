@@ -0,0 +1,179 @@
+import contextlib
+import contextvars
+import cProfile
+import os
+import random
+import threading
+import time
+
+# Per-request stage timings in milliseconds, set while a request asks for its breakdown.
+REQUEST_TIMINGS = contextvars.ContextVar("request_timings", default=None)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def metric_key(name, labels):
+    # Label values are rendered as text anyway; as strings a missing value cannot break the sort.
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Metrics:
+    """Process-wide counters, gauges and latency histograms, rendered in the Prometheus text format.
+
+    Collectors registered with add_collector are called at scrape time and
+    yield (name, labels, value) gauges, so stats kept elsewhere need no copying.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add(self, name, value, **labels):
+        """Move a gauge up or down by value."""
+        key = metric_key(name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            counts, total, count = self.histograms.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[index] += 1
+            self.histograms[key] = (counts, total + seconds, count + 1)
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        """Time a pipeline stage into the stage histogram and the current request's breakdown."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe("whisper_stage_seconds", elapsed, stage=stage)
+            timings = REQUEST_TIMINGS.get()
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + 1000 * elapsed
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {
+                key: (list(counts), total, count) for key, (counts, total, count) in self.histograms.items()
+            }
+
+        # The exposition format allows one TYPE line per metric family, ahead of all its samples.
+        families = {}
+
+        def family(name, kind):
+            if name not in families:
+                families[name] = [f"# TYPE {name} {kind}"]
+            return families[name]
+
+        for (name, labels), value in sorted(counters.items()):
+            family(name, "counter").append(f"{name}{format_labels(labels)} {value}")
+
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            samples = family(name, "histogram")
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append(f"{name}_bucket{format_labels(labels, le=bound)} {bucket_count}")
+            samples.append(f"{name}_bucket{format_labels(labels, le='+Inf')} {count}")
+            samples.append(f"{name}_sum{format_labels(labels)} {total}")
+            samples.append(f"{name}_count{format_labels(labels)} {count}")
+
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                gauges[metric_key(name, labels)] = value
+        for (name, labels), value in sorted(gauges.items()):
+            family(name, "gauge").append(f"{name}{format_labels(labels)} {float(value)}")
+
+        lines = [line for samples in families.values() for line in samples]
+        return "\n".join(lines) + "\n"
+
+    async def handle_http(self, reader, writer):
+        """Answer any HTTP request with the current metrics."""
+        try:
+            while (await reader.readline()).strip():
+                pass
+            body = self.render().encode()
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        except Exception as e:
+            print(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+
+class SlowRequestProfiler:
+    """Profiles a random sample of requests and keeps the profiles of those that turn out slow.
+
+    mode "cprofile" profiles the calling thread and writes .prof files for
+    pstats or snakeviz; mode "torch" uses the torch profiler, which also sees
+    the batcher thread's model calls, and writes Chrome traces. Only one
+    request is profiled at a time.
+    """
+
+    def __init__(self, directory="profiles", sample_rate=0.1, slow_seconds=2.0, mode="cprofile"):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.mode = mode
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def capture(self, name):
+        if random.random() >= self.sample_rate or not self.lock.acquire(blocking=False):
+            yield
+            return
+
+        if self.mode == "torch":
+            import torch.profiler
+            profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+            profiler.__enter__()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.mode == "torch":
+                profiler.__exit__(None, None, None)
+            else:
+                profiler.disable()
+            self.lock.release()
+            elapsed = time.perf_counter() - started
+            if elapsed >= self.slow_seconds:
+                self.save(profiler, name, elapsed)
+
+    def save(self, profiler, name, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        stem = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{int(1000 * elapsed)}ms")
+        if self.mode == "torch":
+            profiler.export_chrome_trace(stem + ".json")
+        else:
+            profiler.dump_stats(stem + ".prof")
+        print(f"Saved profile of slow {name} request ({elapsed:.2f}s) to {stem}")
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from lazy import LazyModule
+
+torch = LazyModule("torch")
+whisper = LazyModule("whisper")
+
+
+def model_bytes(model):
+    """Return the memory taken by a model's weights, including the packed weights of quantized layers."""
+    total = 0
+    for value in model.state_dict().values():
+        # Dynamically quantized linear layers store their weight and bias as a tuple.
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.element_size() * tensor.nelement()
+    return total
+
+
+def quantize_model(model):
+    """Return a CPU copy of a Whisper model with its linear layers dynamically quantized to int8.
+
+    Weights are stored as int8 and activations quantized on the fly, which
+    cuts the size of the linear layers by four and speeds them up on CPUs with
+    int8 dot-product instructions. Embeddings, convolutions and layer norms
+    stay in fp32.
+    """
+    model = model.cpu()
+    # whisper's Linear only adds dtype casting on top of nn.Linear, but the
+    # quantizer matches module types exactly, so present its layers as plain ones.
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def warm_up(model):
+    """Decode a few tokens of silence so the first real request does not pay for kernel selection and lazy setup."""
+    mel = torch.zeros((1, model.dims.n_mels, whisper.audio.N_FRAMES), device=model.device)
+    options = whisper.DecodingOptions(language="en", sample_len=4, without_timestamps=True,
+                                      fp16=model.device.type == "cuda")
+    with torch.inference_mode():
+        whisper.decode(model, mel, options)
+
+
+class ModelRegistry:
+    """Keeps several Whisper models resident under a memory budget, loading them in the background.
+
+    Models are looked up by name; a miss starts a load on the loader thread and
+    returns a future, and once the budget is exceeded the least recently used
+    models are dropped. Requests already holding an evicted model keep it alive
+    until they finish. Models named in quantize are loaded on the CPU with
+    int8 linear layers. With warm set, a loaded model runs a short dummy decode
+    before it is handed out.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 ** 3, preload=(), quantize=(), warm=True):
+        self.max_bytes = max_bytes
+        self.quantize = set(quantize)
+        self.warm = warm
+        self.models = OrderedDict()
+        self.loading = {}
+        self.warming = set()
+        self.load_times = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        for name in preload:
+            self.get(name)
+
+    def load(self, name):
+        if name in self.quantize:
+            return quantize_model(whisper.load_model(name, device="cpu"))
+        return whisper.load_model(name)
+
+    def get(self, name):
+        """Return a future resolving to the named model, starting a background load if needed."""
+        with self.lock:
+            if name in self.models:
+                self.models.move_to_end(name)
+                future = Future()
+                future.set_result(self.models[name][0])
+                return future
+            if name not in self.loading:
+                self.loading[name] = self.loader.submit(self.load_and_register, name)
+            return self.loading[name]
+
+    def load_and_register(self, name):
+        started = time.monotonic()
+        try:
+            model = self.load(name)
+            if self.warm:
+                with self.lock:
+                    self.warming.add(name)
+                warm_up(model)
+        except Exception:
+            with self.lock:
+                del self.loading[name]
+                self.warming.discard(name)
+            raise
+
+        size = model_bytes(model)
+        with self.lock:
+            self.load_times[name] = time.monotonic() - started
+            self.models[name] = (model, size)
+            self.total_bytes += size
+            del self.loading[name]
+            self.warming.discard(name)
+            self.evict()
+        print(f"Loaded {name} model in {self.load_times[name]:.1f}s")
+        return model
+
+    def stage(self, name):
+        """Return "warming" while a loaded model runs its warm-up decode, else "loading"."""
+        with self.lock:
+            return "warming" if name in self.warming else "loading"
+
+    def evict(self):
+        """Drop least recently used models until the registry fits its budget, keeping the newest."""
+        while self.total_bytes > self.max_bytes and len(self.models) > 1:
+            name, (_, size) = self.models.popitem(last=False)
+            self.total_bytes -= size
+            print(f"Evicted {name} model from memory")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "loaded_models": list(self.models),
+                "loading_models": list(self.loading),
+                "warming_models": sorted(self.warming),
+                "quantized_models": sorted(self.quantize),
+                "model_bytes": self.total_bytes,
+                "max_model_bytes": self.max_bytes,
+                "load_seconds": dict(self.load_times),
+            }
@@ -0,0 +1,141 @@
+import json
+import struct
+
+# Frame types.
+REQUEST = 1
+RESPONSE = 2
+NOTICE = 3
+
+# Codecs for the control body of a frame.
+CODEC_JSON = 0
+CODEC_BINARY = 1
+
+# Every frame is this header, a control body and an optional raw payload such as audio.
+HEADER = struct.Struct("!BBIII")  # frame type, codec, request id, body length, payload length
+
+# Interim responses that do not complete a request.
+NOTICE_STATUSES = ("queued", "loading", "warming", "partial")
+
+NONE, FALSE, TRUE, INT, FLOAT, STR, BYTES, LIST, DICT = range(9)
+INT64 = struct.Struct("!q")
+FLOAT64 = struct.Struct("!d")
+LENGTH = struct.Struct("!I")
+
+
+def encode_value(value, out):
+    """Append the binary encoding of a JSON-like value to out."""
+    if value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        out.append(INT)
+        out += INT64.pack(value)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += FLOAT64.pack(value)
+    elif isinstance(value, str):
+        data = value.encode()
+        out.append(STR)
+        out += LENGTH.pack(len(data))
+        out += data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(BYTES)
+        out += LENGTH.pack(len(value))
+        out += value
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        out += LENGTH.pack(len(value))
+        for item in value:
+            encode_value(item, out)
+    elif isinstance(value, dict):
+        out.append(DICT)
+        out += LENGTH.pack(len(value))
+        for key, item in value.items():
+            encode_value(str(key), out)
+            encode_value(item, out)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__} values")
+
+
+def decode_value(data, offset=0):
+    """Decode one binary-encoded value from data and return it with the offset just past it."""
+    tag = data[offset]
+    offset += 1
+    if tag == NONE:
+        return None, offset
+    if tag == TRUE:
+        return True, offset
+    if tag == FALSE:
+        return False, offset
+    if tag == INT:
+        return INT64.unpack_from(data, offset)[0], offset + INT64.size
+    if tag == FLOAT:
+        return FLOAT64.unpack_from(data, offset)[0], offset + FLOAT64.size
+
+    length = LENGTH.unpack_from(data, offset)[0]
+    offset += LENGTH.size
+    if tag == STR:
+        return str(data[offset:offset + length], "utf-8"), offset + length
+    if tag == BYTES:
+        return bytes(data[offset:offset + length]), offset + length
+    if tag == LIST:
+        items = []
+        for _ in range(length):
+            item, offset = decode_value(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == DICT:
+        items = {}
+        for _ in range(length):
+            key, offset = decode_value(data, offset)
+            items[key], offset = decode_value(data, offset)
+        return items, offset
+    raise ValueError(f"Unknown value tag {tag}")
+
+
+def encode_body(message, codec):
+    if codec == CODEC_JSON:
+        return json.dumps(message).encode()
+    out = bytearray()
+    encode_value(message, out)
+    return out
+
+
+def decode_body(body, codec):
+    if codec == CODEC_JSON:
+        return json.loads(bytes(body))
+    message, _ = decode_value(body)
+    return message
+
+
+def frame_type(message):
+    """Return the frame type a server should send a response dict as."""
+    return NOTICE if message.get("status") in NOTICE_STATUSES else RESPONSE
+
+
+def pack_frame(kind, message, payload=None, codec=CODEC_BINARY):
+    """Return the header and body of a frame; the payload, if any, is written after them as is.
+
+    The request id travels in the header, so it is taken out of the message here.
+    """
+    message = dict(message)
+    request_id = message.pop("request_id", None) or 0
+    body = encode_body(message, codec)
+    header = HEADER.pack(kind, codec, request_id, len(body), len(payload) if payload is not None else 0)
+    return header + body
+
+
+def unpack_header(data):
+    """Return the frame type, codec, request id, body length and payload length of a header."""
+    return HEADER.unpack(data)
+
+
+def read_message(codec, request_id, body):
+    """Decode a frame body, putting the request id from its header back into the message."""
+    message = decode_body(body, codec)
+    if request_id:
+        message["request_id"] = request_id
+    return message
@@ -0,0 +1,175 @@
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class InferenceScheduler:
+    """Runs inference jobs on a fixed pool of worker threads fed by a bounded queue."""
+
+    def __init__(self, workers=1, max_queue=16, initializer=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.initializer = initializer
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.threads = [
+            threading.Thread(target=self.worker, name=f"inference-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, func, *args):
+        """Queue func(*args) and return its future with the number of jobs it waits behind.
+
+        func runs in a copy of the caller's context, so context variables such
+        as the request's timing breakdown follow it onto the worker. Raises
+        queue.Full when the queue is at capacity, so callers can turn the
+        request away instead of letting latency grow without bound.
+        """
+        future = Future()
+        with self.lock:
+            waiting = self.jobs.qsize()
+            position = waiting + 1 if self.active + waiting >= self.workers else 0
+            try:
+                self.jobs.put_nowait((future, contextvars.copy_context(), func, args, time.monotonic()))
+            except queue.Full:
+                self.rejected += 1
+                raise
+        return future, position
+
+    def worker(self):
+        if self.initializer:
+            self.initializer()
+        while True:
+            future, context, func, args, queued_at = self.jobs.get()
+            wait = time.monotonic() - queued_at
+            with self.lock:
+                self.active += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(context.run(func, *args))
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.completed += 1
+
+    def stats(self):
+        """Return queue depth, worker usage and queueing delay figures for sizing the server."""
+        with self.lock:
+            started = self.completed + self.active
+            return {
+                "workers": self.workers,
+                "active_jobs": self.active,
+                "queue_depth": self.jobs.qsize(),
+                "max_queue": self.max_queue,
+                "completed_jobs": self.completed,
+                "rejected_jobs": self.rejected,
+                "avg_wait_ms": 1000 * self.total_wait / started if started else 0.0,
+                "max_wait_ms": 1000 * self.max_wait,
+            }
+
+
+class DecodeBatcher:
+    """Groups model calls that arrive close together into a single batched pass.
+
+    Jobs are stacks of inputs submitted under a key; jobs sharing a key that
+    arrive within the batching window, up to max_batch inputs in total, are
+    handed to run_batch together and its outputs are fanned back per job.
+    """
+
+    def __init__(self, run_batch, window=0.03, max_batch=8, initializer=None):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.initializer = initializer
+        self.pending = []
+        self.condition = threading.Condition()
+        self.batches = 0
+        self.batched_jobs = 0
+        self.batched_inputs = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.thread = threading.Thread(target=self.worker, name="decode-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, key, inputs):
+        """Queue a stack of inputs and return a future for the list of their outputs."""
+        future = Future()
+        with self.condition:
+            self.pending.append((key, inputs, future, time.monotonic()))
+            self.condition.notify()
+        return future
+
+    def next_batch(self):
+        """Wait for the oldest job's window to close or fill up, then take its batch."""
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            key, _, _, queued_at = self.pending[0]
+            deadline = queued_at + self.window
+            while True:
+                size = sum(len(inputs) for job_key, inputs, _, _ in self.pending if job_key == key)
+                remaining = deadline - time.monotonic()
+                if size >= self.max_batch or remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            batch = []
+            size = 0
+            for job in list(self.pending):
+                if job[0] == key and (not batch or size + len(job[1]) <= self.max_batch):
+                    batch.append(job)
+                    size += len(job[1])
+                    self.pending.remove(job)
+            return key, batch, size
+
+    def worker(self):
+        if self.initializer:
+            self.initializer()
+        while True:
+            key, batch, size = self.next_batch()
+            started = time.monotonic()
+            waits = [started - queued_at for _, _, _, queued_at in batch]
+            with self.condition:
+                self.batches += 1
+                self.batched_jobs += len(batch)
+                self.batched_inputs += size
+                self.total_wait += sum(waits)
+                self.max_wait = max(self.max_wait, *waits)
+
+            futures = [future for _, _, future, _ in batch]
+            try:
+                outputs = self.run_batch(key, [inputs for _, inputs, _, _ in batch])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, output in zip(futures, outputs):
+                future.set_result(output)
+
+    def stats(self):
+        """Return the achieved batch sizes and the queueing delay batching added."""
+        with self.condition:
+            batches = self.batches or 1
+            jobs = self.batched_jobs or 1
+            return {
+                "batch_window_ms": 1000 * self.window,
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "avg_batch_inputs": self.batched_inputs / batches,
+                "avg_batch_requests": self.batched_jobs / batches,
+                "avg_batch_wait_ms": 1000 * self.total_wait / jobs,
+                "max_batch_wait_ms": 1000 * self.max_wait,
+            }
@@ -0,0 +1,158 @@
+import contextvars
+import hashlib
+import threading
+
+import numpy as np
+
+from audio import SAMPLE_RATE, decode_stream
+
+# Called with each new piece of transcript text while a request streams its tokens.
+TOKEN_LISTENER = contextvars.ContextVar("token_listener", default=None)
+
+
+class StreamSession:
+    """Rolling audio window of a live stream and the transcript committed from it so far.
+
+    The window starting at the first uncommitted sample is re-decoded as audio
+    arrives. A segment is committed, and its audio dropped from the window, once
+    two consecutive decodes agree on it; the rest of the hypothesis is sent as
+    tentative text that may still change.
+    """
+
+    def __init__(self, stream_id, writer, model, options, mode, session_id, step_seconds=0.5, max_window_seconds=20):
+        self.stream_id = stream_id
+        self.writer = writer
+        self.model = model
+        self.options = options
+        self.mode = mode
+        self.session_id = session_id
+        self.step = int(step_seconds * SAMPLE_RATE)
+        self.max_window = int(max_window_seconds * SAMPLE_RATE)
+        self.audio = np.zeros(0, np.float32)
+        self.chunks = []
+        self.new_samples = 0
+        self.committed = []
+        self.previous = []
+        self.decoding = False
+        self.task = None
+        self.lock = threading.Lock()
+
+    def append(self, pcm):
+        """Add captured samples and return True if a decode should be started for them."""
+        with self.lock:
+            self.chunks.append(pcm)
+            self.new_samples += len(pcm)
+            if self.decoding or self.new_samples < self.step:
+                return False
+            self.decoding = True
+            return True
+
+    def finish_decode(self):
+        """Return True if enough audio arrived during the last decode to warrant another one."""
+        with self.lock:
+            if self.new_samples >= self.step:
+                return True
+            self.decoding = False
+            return False
+
+    def window(self):
+        """Return the uncommitted audio, folding in the samples received since the last call."""
+        with self.lock:
+            if self.chunks:
+                self.audio = np.concatenate([self.audio, *self.chunks])
+                self.chunks = []
+            self.new_samples = 0
+            return self.audio
+
+    def update(self, segments, final=False):
+        """Commit the stable prefix of a hypothesis and return the partial-result message for it.
+
+        segments are dicts with start/end times in seconds relative to the
+        window that was decoded. When final is set everything is committed.
+        """
+        with self.lock:
+            texts = [segment["text"] for segment in segments]
+            if final:
+                stable = len(segments)
+            else:
+                stable = 0
+                while stable < len(segments) - 1 and stable < len(self.previous) \
+                        and texts[stable] == self.previous[stable]:
+                    stable += 1
+                # A window about to outgrow the model's 30 seconds commits regardless of agreement.
+                if len(self.audio) > self.max_window:
+                    stable = max(stable, len(segments) - 1)
+
+            if stable:
+                self.committed.extend(text for text in texts[:stable] if text)
+                cut = int(segments[stable - 1]["end"] * SAMPLE_RATE)
+                self.audio = self.audio[cut:]
+            self.previous = texts[stable:]
+
+            committed = " ".join(self.committed)
+            tentative = " ".join(text for text in self.previous if text)
+            return {
+                "status": "success" if final else "partial",
+                "stream_id": self.stream_id,
+                "committed": committed,
+                "tentative": tentative,
+                "text": " ".join(text for text in (committed, tentative) if text),
+            }
+
+
+class UploadSession:
+    """Compressed audio upload that is decoded while its bytes are still arriving.
+
+    The handle is the hash of the encoded bytes, as for a file sent in one go.
+    """
+
+    def __init__(self, upload_id, writer, codec):
+        self.upload_id = upload_id
+        self.writer = writer
+        self.codec = codec
+        self.decoder = decode_stream()
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def feed(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        self.decoder.feed(data)
+
+    def finish(self):
+        """Wait for the decoder to drain and return the handle and decoded audio."""
+        pcm = self.decoder.finish()
+        return self.hash.hexdigest(), np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+
+
+class TokenStream:
+    """Decoding options for one window that report its text as the decoder picks tokens.
+
+    It is added to the decoder's logit filters, where it leaves the logits
+    alone and only reads the tokens chosen so far, so text trails the decoder
+    by one token until update is called with the final tokens. As a batcher
+    key it hashes by identity and is never batched with another request.
+    """
+
+    def __init__(self, options, tokenizer, on_text, prefix=""):
+        self.options = options
+        self.tokenizer = tokenizer
+        self.on_text = on_text
+        self.prefix = prefix
+        self.sample_begin = None
+        self.sent = ""
+
+    def apply(self, logits, tokens):
+        if self.sample_begin is None:
+            self.sample_begin = tokens.shape[1]
+        self.update(tokens[0, self.sample_begin:].tolist())
+
+    def update(self, tokens):
+        """Pass on the text the tokens add to what was already sent."""
+        text = self.tokenizer.decode([token for token in tokens if token < self.tokenizer.eot]).strip()
+        # Hold back text that ends inside a multi-byte character split across tokens.
+        if not text or text.endswith("\ufffd") or not text.startswith(self.sent):
+            return
+        if len(text) > len(self.sent):
+            self.on_text((self.prefix if not self.sent else "") + text[len(self.sent):])
+            self.sent = text
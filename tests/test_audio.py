@@ -0,0 +1,40 @@
+import numpy as np
+
+from audio import SAMPLE_RATE, speech_regions, speech_windows, trim_silence
+
+
+def voiced(seconds, dip_db):
+    """A harmonic tone whose level dips by up to dip_db three times a second, like syllables."""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    envelope = 10 ** (-dip_db * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)) / 20)
+    return (0.3 * envelope * (np.sin(2 * np.pi * 150 * t) + 0.5 * np.sin(2 * np.pi * 300 * t))).astype(np.float32)
+
+
+def covered(regions, audio):
+    return sum(end - start for start, end in regions) / len(audio)
+
+
+def test_speech_without_silence_is_kept():
+    for seconds in (2, 10):
+        for dip_db in (6, 20, 34):
+            audio = voiced(seconds, dip_db)
+            assert covered(speech_regions(audio), audio) > 0.9
+
+
+def test_trimmed_recording_survives_server_vad():
+    audio = np.zeros(4 * SAMPLE_RATE, np.float32)
+    audio[SAMPLE_RATE:3 * SAMPLE_RATE] = voiced(2, 20)
+    trimmed = trim_silence(audio)
+    assert len(trimmed) < len(audio)
+    assert covered(speech_windows(trimmed), trimmed) > 0.9
+
+
+def test_silence_is_dropped_around_speech():
+    audio = np.zeros(6 * SAMPLE_RATE, np.float32)
+    audio[2 * SAMPLE_RATE:4 * SAMPLE_RATE] = voiced(2, 20)
+    assert covered(speech_regions(audio), audio) < 0.5
+
+
+def test_windows_fall_back_to_whole_clip_without_speech():
+    audio = np.zeros(SAMPLE_RATE, np.float32)
+    assert speech_windows(audio) == [(0, len(audio))]
@@ -0,0 +1,19 @@
+from metrics import Metrics
+
+
+def test_render_survives_missing_label_values():
+    metrics = Metrics()
+    metrics.inc("whisper_requests_total", command=None)
+    metrics.inc("whisper_requests_total", command="transcribe")
+    metrics.observe("whisper_request_seconds", 0.2, command=None)
+    metrics.observe("whisper_request_seconds", 0.2, command="transcribe")
+    text = metrics.render()
+    assert 'whisper_requests_total{command="None"} 1' in text
+    assert 'whisper_requests_total{command="transcribe"} 1' in text
+
+
+def test_render_emits_one_type_line_per_family():
+    metrics = Metrics()
+    metrics.inc("whisper_requests_total", command="transcribe")
+    metrics.inc("whisper_requests_total", command="translate")
+    assert metrics.render().count("# TYPE whisper_requests_total counter") == 1
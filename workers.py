@@ -0,0 +1,196 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cache import AudioEntry
+from metrics import REQUEST_TIMINGS
+
+
+def attach_shared_audio(name, length):
+    """Map a block of float32 samples created by the front end, leaving its cleanup to the front end."""
+    # Spawned processes share the front end's resource tracker, so attaching does not hand the block over.
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray((length,), np.float32, buffer=block.buf)
+
+
+def worker_main(cores, jobs, results, settings):
+    """Run analysis jobs in a worker process with its own models, pinned to the given cores."""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    # Imported here because backend imports this module.
+    from backend import WhisperServer
+    from delivery import NullSender
+
+    engine = WhisperServer(None, workers=1, max_queue=1, torch_threads=max(1, len(cores)),
+                           model_threads=max(1, len(cores)), outputs=NullSender(), **settings)
+    engine.init_worker()
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, model_name, commands, options, shared = job
+        timings = {}
+        REQUEST_TIMINGS.set(timings)
+        try:
+            model = engine.models.get(model_name).result()
+            response = None
+            if shared is not None:
+                name, length, handle = shared
+                block, audio = attach_shared_audio(name, length)
+                entry = AudioEntry(handle, audio)
+                try:
+                    response = engine.run_audio_commands(entry, model, commands, options["mode"],
+                                                         options["session_id"], options["vad"], emit=False)
+                finally:
+                    # The block can only be unmapped once nothing views it.
+                    del entry, audio
+                    block.close()
+            results.put((job_id, response, timings, None))
+        except Exception as e:
+            results.put((job_id, None, timings, f"{type(e).__name__}: {e}"))
+
+
+class InferenceProcesses:
+    """Runs model work in separate processes so Python-bound decoding is not serialized by one GIL.
+
+    Every process loads its own models and is pinned to its share of the
+    cores. Audio is handed over in shared memory rather than pickled, and a
+    process that dies is started again; the jobs it held fail, while the
+    listener and the other processes carry on.
+    """
+
+    def __init__(self, processes, settings, check_interval=0.5):
+        self.settings = settings
+        self.check_interval = check_interval
+        self.context = multiprocessing.get_context("spawn")
+        if hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+        share = max(1, len(cpus) // processes)
+        self.cores = [cpus[i * share:(i + 1) * share] or cpus for i in range(processes)]
+        self.results = self.context.Queue()
+        self.job_ids = itertools.count()
+        self.pending = {}
+        self.queues = [None] * processes
+        self.processes = [None] * processes
+        self.outstanding = [0] * processes
+        self.restarts = 0
+        self.completed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        for index in range(processes):
+            self.start_process(index)
+        threading.Thread(target=self.collect, name="process-results", daemon=True).start()
+        threading.Thread(target=self.monitor, name="process-monitor", daemon=True).start()
+
+    def start_process(self, index):
+        self.queues[index] = self.context.Queue()
+        self.processes[index] = self.context.Process(
+            target=worker_main, name=f"inference-process-{index}", daemon=True,
+            args=(self.cores[index], self.queues[index], self.results, self.settings),
+        )
+        self.processes[index].start()
+
+    def submit(self, model_name, commands=(), options=None, audio=None, handle=None, index=None):
+        """Queue a job on the given process, or the least busy one, and return a future for its response.
+
+        Without audio the job only makes sure the process has the model loaded.
+        """
+        shared = None
+        block = None
+        if audio is not None:
+            block = shared_memory.SharedMemory(create=True, size=max(1, audio.size * 4))
+            np.ndarray((audio.size,), np.float32, buffer=block.buf)[:] = audio
+            shared = (block.name, audio.size, handle)
+
+        future = Future()
+        with self.lock:
+            if index is None:
+                index = min(range(len(self.processes)), key=self.outstanding.__getitem__)
+            job_id = next(self.job_ids)
+            self.pending[job_id] = (future, index, block)
+            self.outstanding[index] += 1
+            self.queues[index].put((job_id, model_name, list(commands), options, shared))
+        return future
+
+    def load(self, model_name):
+        """Return futures that finish once every process has the model loaded."""
+        return [self.submit(model_name, index=index) for index in range(len(self.processes))]
+
+    def run(self, entry, model_name, commands, options):
+        """Run commands on an audio entry in a worker process and wait for their responses."""
+        future = self.submit(model_name, commands, options, entry.audio, entry.handle)
+        response, timings = future.result()
+        current = REQUEST_TIMINGS.get()
+        if current is not None:
+            for stage, milliseconds in timings.items():
+                current[stage] = current.get(stage, 0.0) + milliseconds
+        return response
+
+    def finish(self, job_id):
+        """Forget a job and release its shared memory, returning its future if it was still pending."""
+        with self.lock:
+            job = self.pending.pop(job_id, None)
+            if job is None:
+                return None
+            future, index, block = job
+            self.outstanding[index] -= 1
+        if block is not None:
+            block.close()
+            block.unlink()
+        return future
+
+    def collect(self):
+        while True:
+            job_id, response, timings, error = self.results.get()
+            future = self.finish(job_id)
+            if future is None:
+                continue
+            with self.lock:
+                if error:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result((response, timings))
+
+    def monitor(self):
+        """Restart processes that have died and fail the jobs they were holding."""
+        while True:
+            time.sleep(self.check_interval)
+            for index, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                print(f"Inference process {index} exited with code {process.exitcode}, restarting")
+                # Restarting under the lock keeps new jobs out of the dead process's queue.
+                with self.lock:
+                    lost = [job_id for job_id, (_, job_index, _) in self.pending.items() if job_index == index]
+                    self.restarts += 1
+                    self.start_process(index)
+                for job_id in lost:
+                    future = self.finish(job_id)
+                    if future is not None:
+                        with self.lock:
+                            self.failed += 1
+                        future.set_exception(RuntimeError(f"Inference process {index} crashed"))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "processes": len(self.processes),
+                "alive_processes": sum(process.is_alive() for process in self.processes),
+                "outstanding_jobs": sum(self.outstanding),
+                "completed_jobs": self.completed,
+                "failed_jobs": self.failed,
+                "restarts": self.restarts,
+            }